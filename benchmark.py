@@ -0,0 +1,419 @@
+# USAGE
+# python benchmark.py --quick
+# python benchmark.py --output results.json
+# python benchmark.py --model detector/MobileNetSSD_deploy.caffemodel --input videos/example_01.mp4
+
+# import the necessary packages
+from tracker.centroidtracker import CentroidTracker
+from tracker.trackerpool import TrackerPool
+from detector.detector import decode, detect
+from detector import backends
+from utils.eventlog import EventLog
+from utils.store import EventStore
+import people_counter
+import numpy as np
+import subprocess
+import statistics
+import platform
+import argparse
+import tempfile
+import logging
+import time
+import json
+import sys
+import cv2
+import os
+
+def parse_arguments():
+	# function to parse the arguments
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-o", "--output", type=str,
+		help="path to write the JSON results to (default: stdout)")
+	ap.add_argument("--seed", type=int, default=42,
+		help="seed of the synthetic scenes")
+	ap.add_argument("--repeat", type=int, default=3,
+		help="# of runs of every benchmark (the best and median are reported)")
+	ap.add_argument("--frames", type=int, default=300,
+		help="# of frames per synthetic run")
+	ap.add_argument("--people", type=int, nargs="+", default=[1, 10, 50],
+		help="person counts to sweep")
+	ap.add_argument("--resolutions", type=str, nargs="+", default=["640x480", "1280x720"],
+		help="frame sizes (WxH) to sweep for the dlib trackers and the end-to-end runs")
+	ap.add_argument("--skip-frames", type=int, nargs="+", default=[10, 30],
+		help="skip frames to sweep in the end-to-end runs")
+	ap.add_argument("--cameras", type=int, nargs="+", default=[1, 2],
+		help="camera counts to sweep in the end-to-end runs")
+	ap.add_argument("--tracker-workers", type=int, nargs="+", default=[1, 2],
+		help="# of dlib tracker processes/threads to sweep")
+	ap.add_argument("--tracker-modes", type=str, nargs="+", default=["process", "thread"],
+		choices=["process", "thread"],
+		help="parallel tracker modes to sweep (--tracker-mode of the counter)")
+	ap.add_argument("-p", "--prototxt", type=str, default="detector/MobileNetSSD_deploy.prototxt",
+		help="path to Caffe 'deploy' prototxt file")
+	ap.add_argument("-m", "--model", type=str, default="detector/MobileNetSSD_deploy.caffemodel",
+		help="path to Caffe pre-trained model (the end-to-end runs are skipped without it)")
+	ap.add_argument("-i", "--input", type=str,
+		help="recorded video for the end-to-end and backend runs (default: a synthetic one)")
+	ap.add_argument("--onnx", type=str,
+		help="ONNX export of the model for the onnxruntime/openvino backends")
+	ap.add_argument("--backends", type=str, nargs="+", default=["opencv"],
+		help="backend[:precision] runs to compare, the first one is the accuracy "
+		"reference (e.g. opencv onnxruntime onnxruntime:int8 openvino)")
+	ap.add_argument("--dnn-threads", type=int, default=0,
+		help="# of threads of the inference engines (0 = their default)")
+	ap.add_argument("--quick", action="store_true",
+		help="a short run (60 frames, a single repeat) to check the harness")
+	args = vars(ap.parse_args())
+	if args["quick"]:
+		args["frames"] = 60
+		args["repeat"] = 1
+	return args
+
+def environment(args):
+	# what the numbers were measured on, to compare runs between commits
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True,
+			text = True, check = True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		"commit": commit,
+		"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"opencv": cv2.__version__,
+		"platform": platform.platform(),
+		"processor": platform.processor(),
+		"cpus": os.cpu_count(),
+		"opencv_threads": cv2.getNumThreads(),
+		"seed": args["seed"],
+		"frames": args["frames"],
+		"repeat": args["repeat"],
+	}
+
+def progress(message):
+	# progress goes to stderr, the results to stdout
+	print(message, file = sys.stderr, flush = True)
+
+def measure(name, params, run, repeat):
+	# run() does one pass and returns how many operations it did (or the
+	# operations and the seconds they took, to leave its setup out);
+	# report the best and median pass
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		ops = run()
+		elapsed = time.perf_counter() - start
+		if isinstance(ops, tuple):
+			(ops, elapsed) = ops
+		times.append(elapsed)
+	best = min(times)
+	result = {
+		"bench": name,
+		"params": params,
+		"ops": ops,
+		"best_s": best,
+		"median_s": statistics.median(times),
+		"ops_per_s": ops / best if best else None,
+		"us_per_op": 1e6 * best / ops if ops else None,
+	}
+	progress("{:<10} {:<70} {:>12.1f} ops/s".format(name, json.dumps(params),
+		result["ops_per_s"] or 0))
+	return result
+
+def scene(seed, people, frames, W, H):
+	# boxes of people walking up or down through the frame (wrapping
+	# around), shape (frames, people, 4)
+	rng = np.random.default_rng(seed)
+	size = max(8, H // 8)
+	x = rng.integers(0, W - size, people)
+	y = rng.integers(0, H - size, people)
+	speed = rng.choice([-1, 1], people) * rng.uniform(2, 5, people) * H / 480.0
+	t = np.arange(frames)[:, None]
+	y = (y + speed * t).astype("int") % (H - size)
+	x = np.broadcast_to(x, y.shape)
+	return np.stack([x, y, x + size, y + size], axis = -1)
+
+def draw(boxes, W, H):
+	# a gray frame with a textured square per person, so the correlation
+	# trackers have something to lock on
+	frame = np.full((H, W, 3), 40, dtype = "uint8")
+	for (startX, startY, endX, endY) in boxes:
+		frame[startY:endY, startX:endX] = 255
+		frame[startY:endY:4, startX:endX] = 120
+	return frame
+
+def synthetic_video(path, seed, people, frames, W, H):
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (W, H))
+	for boxes in scene(seed, people, frames, W, H):
+		writer.write(draw(boxes, W, H))
+	writer.release()
+	return path
+
+def counter_args(*extra):
+	# the people_counter defaults, as parsed from its command line
+	argv = sys.argv
+	sys.argv = ["people_counter.py", "-m", "none", "--headless"] + [str(e) for e in extra]
+	try:
+		return people_counter.parse_arguments()
+	finally:
+		sys.argv = argv
+
+def bench_decode(args):
+	# turning raw SSD output into person boxes, with and without NMS
+	results = []
+	rng = np.random.default_rng(args["seed"])
+	for count in (10, 100, 1000):
+		rows = np.zeros((count, 7), dtype = "float32")
+		rows[:, 1] = rng.choice([15, 7, 9], count)
+		rows[:, 2] = rng.uniform(0, 1, count)
+		rows[:, 3:5] = rng.uniform(0, 0.8, (count, 2))
+		rows[:, 5:7] = rows[:, 3:5] + rng.uniform(0.05, 0.2, (count, 2))
+		detections = rows.reshape(1, 1, count, 7)
+		for nms in (None, 0.3):
+			def run():
+				for _ in range(1000):
+					decode(detections, 500, 375, 0.4, nms = nms)
+				return 1000
+			results.append(measure("decode", {"detections": count, "nms": nms},
+				run, args["repeat"]))
+	return results
+
+def bench_centroid(args):
+	# CentroidTracker.update over a walking crowd, both assignment methods
+	results = []
+	for people in args["people"]:
+		boxes = scene(args["seed"], people, args["frames"], 500, 375)
+		for method in ("greedy", "hungarian"):
+			def run():
+				ct = CentroidTracker(maxDisappeared = 40, maxDistance = 50, method = method)
+				for rects in boxes:
+					ct.update(rects)
+				return len(boxes)
+			results.append(measure("centroid", {"people": people, "method": method},
+				run, args["repeat"]))
+	return results
+
+def bench_trackers(args):
+	# dlib correlation tracker updates between two detections
+	results = []
+	for resolution in args["resolutions"]:
+		(W, H) = [int(v) for v in resolution.split("x")]
+		for people in args["people"]:
+			boxes = scene(args["seed"], people, args["frames"], W, H)
+			for workers in args["tracker_workers"]:
+				# a single worker updates them serially in either mode
+				for mode in (args["tracker_modes"] if workers > 1 else args["tracker_modes"][:1]):
+					pool = TrackerPool(workers, mode)
+					def run():
+						# the frames are drawn as we go (only the updates are
+						# timed) instead of keeping all of them in memory
+						rgb = cv2.cvtColor(draw(boxes[0], W, H), cv2.COLOR_BGR2RGB)
+						pool.start(rgb, [tuple(b) for b in boxes[0].tolist()])
+						busy = 0.0
+						for b in boxes[1:]:
+							rgb = cv2.cvtColor(draw(b, W, H), cv2.COLOR_BGR2RGB)
+							start = time.perf_counter()
+							pool.update(rgb)
+							busy += time.perf_counter() - start
+						return (len(boxes) - 1, busy)
+					results.append(measure("trackers", {"resolution": resolution,
+						"people": people, "workers": workers, "mode": mode}, run, args["repeat"]))
+					pool.close()
+	return results
+
+def bench_count(args, tmp):
+	# the per-frame counting logic (centroid tracker, trackable objects and
+	# line crossings) of a StreamCounter
+	results = []
+	video = synthetic_video(os.path.join(tmp, "count.mp4"), args["seed"], 1, 2, 500, 375)
+	for people in args["people"]:
+		boxes = scene(args["seed"], people, args["frames"], 500, 375)
+		def run():
+			counter = people_counter.StreamCounter(counter_args(), people_counter.Crossings(),
+				video, is_file = True, offline = True)
+			counter.resize(counter.read())
+			for rects in boxes:
+				counter.count(rects)
+			counter.close()
+			return len(boxes)
+		results.append(measure("count", {"people": people}, run, args["repeat"]))
+	return results
+
+def bench_persistence(args, tmp):
+	# queuing crossings to the database writer (until they are written)
+	# and appending them to the log in every format
+	results = []
+	events = 10 * args["frames"]
+	def run():
+		path = os.path.join(tmp, "bench.db")
+		for suffix in ("", "-wal", "-shm"):
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+		store = EventStore(path)
+		for i in range(events):
+			store.add("in" if i % 2 else "out", i, i // 2, i // 2)
+		store.close()
+		return events
+	results.append(measure("store", {"events": events}, run, args["repeat"]))
+
+	for fmt in ("csv", "gz", "bin"):
+		def run():
+			log = EventLog(os.path.join(tmp, "logs_" + fmt), "bench", fmt)
+			for i in range(events):
+				log.add("in" if i % 2 else "out", i, i // 2, i // 2)
+			log.close()
+			return events
+		results.append(measure("log", {"events": events, "format": fmt},
+			run, args["repeat"]))
+	return results
+
+def sample_frames(args, tmp, count):
+	# frames of the recorded (or a synthetic) video at the counter's 500px
+	# width, spread over the whole video
+	video = args["input"] or synthetic_video(os.path.join(tmp, "frames.mp4"),
+		args["seed"], max(args["people"]), args["frames"], 640, 480)
+	cap = cv2.VideoCapture(video)
+	total = max(1, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+	frames = []
+	for index in np.linspace(0, total - 1, count).astype("int"):
+		cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+		(grabbed, frame) = cap.read()
+		if grabbed:
+			(h, w) = frame.shape[:2]
+			frames.append(cv2.resize(frame, (500, int(h * 500 / float(w))),
+				interpolation = cv2.INTER_AREA))
+	cap.release()
+	return frames
+
+def agreement(reference, detections, threshold = 0.5):
+	# how well the person boxes of a run match the reference run's: boxes
+	# overlapping with an IoU >= threshold are matched greedily per frame
+	(matched, found, expected, drift) = (0, 0, 0, [])
+	for ((refBoxes, refConf), (boxes, conf)) in zip(reference, detections):
+		found += len(boxes)
+		expected += len(refBoxes)
+		if not len(boxes) or not len(refBoxes):
+			continue
+		a = refBoxes[:, None, :].astype("float")
+		b = boxes[None, :, :].astype("float")
+		inter = (np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+			* np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None))
+		area = lambda x: (x[..., 2] - x[..., 0]) * (x[..., 3] - x[..., 1])
+		iou = inter / np.maximum(area(a) + area(b) - inter, 1e-6)
+		used = set()
+		for i in np.argsort(-iou.max(axis = 1)):
+			j = int(iou[i].argmax())
+			if iou[i, j] >= threshold and j not in used:
+				used.add(j)
+				matched += 1
+				drift.append(abs(float(refConf[i]) - float(conf[j])))
+	return {
+		"precision": matched / found if found else None,
+		"recall": matched / expected if expected else None,
+		"mean_confidence_drift": float(np.mean(drift)) if drift else None,
+		"detections": found,
+	}
+
+def bench_backends(args, tmp):
+	# the detector on every inference engine/precision over the same
+	# frames, the first run is the reference the accuracy is measured
+	# against
+	results = []
+	frames = sample_frames(args, tmp, 20)
+	reference = None
+	for name in args["backends"]:
+		(backend, _, precision) = name.partition(":")
+		precision = precision or "fp32"
+		model = args["onnx"]
+		if backend == "opencv" and os.path.exists(args["model"]):
+			model = args["model"]
+		if model is None or not os.path.exists(model):
+			progress("No model for {}, skipping it".format(name))
+			continue
+		try:
+			net = backends.load_network(model, args["prototxt"], backend, precision,
+				args["dnn_threads"])
+		except (ImportError, ValueError) as e:
+			progress("Skipping {}: {}".format(name, e))
+			continue
+
+		detections = []
+		def run():
+			del detections[:]
+			for frame in frames:
+				raw = detect(net, [frame], frame.shape[1::-1])[0]
+				detections.append(decode(raw, frame.shape[1], frame.shape[0]))
+			return len(frames)
+		result = measure("backend", {"backend": backend, "precision": precision,
+			"model": os.path.basename(model)}, run, args["repeat"])
+		if reference is None:
+			reference = list(detections)
+		result["accuracy"] = agreement(reference, detections)
+		results.append(result)
+	return results
+
+def bench_end_to_end(args, tmp):
+	# the whole counter (detection, tracking, counting and persistence)
+	# over a video file, for several skip frames, sizes and camera counts
+	results = []
+	if not os.path.exists(args["model"]):
+		progress("No model at {}, skipping the end-to-end runs".format(args["model"]))
+		return results
+	net = backends.load_network(args["model"], args["prototxt"], threads = args["dnn_threads"])
+
+	cwd = os.getcwd()
+	for resolution in ([None] if args["input"] else args["resolutions"]):
+		if args["input"]:
+			video = os.path.abspath(args["input"])
+		else:
+			(W, H) = [int(v) for v in resolution.split("x")]
+			video = synthetic_video(os.path.join(tmp, "e2e_{}.mp4".format(resolution)),
+				args["seed"], max(args["people"]), args["frames"], W, H)
+		cap = cv2.VideoCapture(video)
+		frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+		cap.release()
+
+		for skip in args["skip_frames"]:
+			for cameras in args["cameras"]:
+				def run():
+					# write the database and logs to the scratch directory
+					run_dir = tempfile.mkdtemp(dir = tmp)
+					os.chdir(run_dir)
+					try:
+						people_counter.count_streams(counter_args("-s", skip), net,
+							[(i, video, True) for i in range(cameras)])
+					finally:
+						os.chdir(cwd)
+					return frames * cameras
+				results.append(measure("end_to_end", {"input": args["input"] or "synthetic",
+					"resolution": resolution, "skip_frames": skip, "cameras": cameras},
+					run, args["repeat"]))
+	return results
+
+def benchmark():
+	# main function for benchmark.py
+	args = parse_arguments()
+	# mute the counter's own logging
+	logging.getLogger().setLevel(logging.WARNING)
+	cv2.setRNGSeed(args["seed"])
+
+	results = []
+	with tempfile.TemporaryDirectory() as tmp:
+		results += bench_decode(args)
+		results += bench_centroid(args)
+		results += bench_trackers(args)
+		results += bench_count(args, tmp)
+		results += bench_persistence(args, tmp)
+		results += bench_backends(args, tmp)
+		results += bench_end_to_end(args, tmp)
+
+	report = json.dumps({"environment": environment(args), "results": results}, indent = 2)
+	if args["output"] is None:
+		print(report)
+	else:
+		with open(args["output"], "w") as file:
+			file.write(report)
+
+if __name__ == "__main__":
+	benchmark()
@@ -0,0 +1,155 @@
+# import the necessary packages
+import numpy as np
+import os
+import cv2
+
+# inference engines and the precisions they can run on the CPU
+BACKENDS = ("opencv", "onnxruntime", "openvino")
+PRECISIONS = ("fp32", "fp16", "int8")
+
+def check(backend, precision, model):
+	# why the backend can't run the model at that precision, None when the
+	# combination is supported (whether this OpenCV build has an fp16 CPU
+	# target is only known when the network loads)
+	if backend not in BACKENDS:
+		return "unknown backend: {}".format(backend)
+	if precision not in PRECISIONS:
+		return "unknown precision: {}".format(precision)
+	if backend == "opencv" and precision == "int8":
+		return "the OpenCV backend runs fp32/fp16 models, use --backend onnxruntime for int8"
+	if backend == "onnxruntime":
+		if not model.endswith(".onnx"):
+			return "--backend onnxruntime needs an .onnx model"
+		if precision == "fp16":
+			return "the ONNX Runtime CPU provider has no fp16 kernels, use fp32 or int8"
+	if backend == "openvino":
+		if not model.endswith((".onnx", ".xml")):
+			return "--backend openvino needs an .onnx or .xml model"
+		if precision == "int8" and not model.endswith(".xml"):
+			return "--backend openvino runs int8 from a quantized IR (.xml) model"
+	return None
+
+class Backend:
+	""" A detection network behind the cv2.dnn.Net setInput/forward calls. """
+
+	# the (W, H) input size the model was exported with, None when it
+	# takes any size
+	size = None
+	# the batch size the model was exported with, None for any
+	batch = None
+
+	def setInput(self, blob):
+		self.blob = blob
+
+	def forward(self):
+		# models exported for a single image run the batch one image at a
+		# time, the image index goes in the first column as with OpenCV
+		if self.batch is None or len(self.blob) <= self.batch:
+			return self.run(self.blob).reshape(1, 1, -1, 7)
+		outputs = []
+		for (i, image) in enumerate(self.blob):
+			output = self.run(image[None]).reshape(-1, 7).copy()
+			output[:, 0] = i
+			outputs.append(output)
+		return np.concatenate(outputs).reshape(1, 1, -1, 7)
+
+	def run(self, blob):
+		# the raw SSD output (..., 7) of a NCHW blob
+		raise NotImplementedError
+
+def fixed(shape):
+	# the static (batch, (W, H)) of an NCHW input shape, None for the
+	# dynamic dimensions
+	dims = [d if isinstance(d, int) and d > 0 else None for d in shape]
+	size = (dims[3], dims[2]) if dims[2] and dims[3] else None
+	return (dims[0], size)
+
+class OpenCVBackend(Backend):
+	""" OpenCV's own DNN engine, for Caffe and ONNX models. """
+
+	def __init__(self, model, prototxt = None, precision = "fp32", threads = 0):
+		if model.endswith(".onnx"):
+			self.net = cv2.dnn.readNetFromONNX(model)
+		else:
+			self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+		self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+
+		# half precision on the CPU needs an OpenCV build that has it
+		target = cv2.dnn.DNN_TARGET_CPU
+		if precision == "fp16":
+			if not hasattr(cv2.dnn, "DNN_TARGET_CPU_FP16"):
+				raise ValueError("this OpenCV build has no fp16 CPU target")
+			target = cv2.dnn.DNN_TARGET_CPU_FP16
+		self.net.setPreferableTarget(target)
+
+		# OpenCV's thread pool is shared by the whole process
+		if threads:
+			cv2.setNumThreads(threads)
+
+	def run(self, blob):
+		self.net.setInput(blob)
+		return self.net.forward()
+
+class OnnxRuntimeBackend(Backend):
+	""" ONNX Runtime on the CPU, optionally on an int8 quantized copy. """
+
+	def __init__(self, model, precision = "fp32", threads = 0):
+		try:
+			import onnxruntime
+		except ImportError:
+			raise ImportError("--backend onnxruntime needs the onnxruntime package")
+
+		# quantize the weights to int8 once, next to the model
+		if precision == "int8":
+			quantized = os.path.splitext(model)[0] + ".int8.onnx"
+			if not os.path.exists(quantized):
+				from onnxruntime.quantization import quantize_dynamic, QuantType
+				quantize_dynamic(model, quantized, weight_type = QuantType.QInt8)
+			model = quantized
+
+		options = onnxruntime.SessionOptions()
+		if threads:
+			options.intra_op_num_threads = threads
+		self.session = onnxruntime.InferenceSession(model, options,
+			providers = ["CPUExecutionProvider"])
+		self.input = self.session.get_inputs()[0]
+		(self.batch, self.size) = fixed(self.input.shape)
+
+	def run(self, blob):
+		return self.session.run(None, {self.input.name: blob})[0]
+
+class OpenVINOBackend(Backend):
+	""" OpenVINO on the CPU, for ONNX models and OpenVINO IR (.xml). """
+
+	def __init__(self, model, precision = "fp32", threads = 0):
+		try:
+			import openvino
+		except ImportError:
+			raise ImportError("--backend openvino needs the openvino package")
+
+		# int8 comes from a model quantized ahead of time (e.g. with NNCF),
+		# fp16 is a hint the CPU plugin follows where the CPU supports it
+		config = {"INFERENCE_PRECISION_HINT": "f16" if precision == "fp16" else "f32"}
+		if threads:
+			config["INFERENCE_NUM_THREADS"] = threads
+
+		core = openvino.Core()
+		self.model = core.compile_model(core.read_model(model), "CPU", config)
+		self.request = self.model.create_infer_request()
+		(self.batch, self.size) = fixed([d.get_length() if d.is_static else None
+			for d in self.model.input(0).get_partial_shape()])
+
+	def run(self, blob):
+		return self.request.infer([blob])[self.model.output(0)]
+
+def load_network(model, prototxt = None, backend = "opencv", precision = "fp32", threads = 0):
+	# load the detection network on the chosen inference engine, every
+	# backend is driven through setInput()/forward() like a cv2.dnn.Net
+	error = check(backend, precision, model)
+	if error is not None:
+		raise ValueError(error)
+	if backend == "onnxruntime":
+		return OnnxRuntimeBackend(model, precision, threads)
+	if backend == "openvino":
+		return OpenVINOBackend(model, precision, threads)
+	return OpenCVBackend(model, prototxt, precision, threads)
@@ -0,0 +1,61 @@
+# import the necessary packages
+from utils.metrics import NULL
+import numpy as np
+import cv2
+
+# initialize the list of class labels MobileNet SSD was trained to detect
+CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
+	"bottle", "bus", "car", "cat", "chair", "cow", "diningtable",
+	"dog", "horse", "motorbike", "person", "pottedplant", "sheep",
+	"sofa", "train", "tvmonitor"]
+
+# class id of the only label we count
+PERSON = CLASSES.index("person")
+
+def detect(net, frames, size, metrics = NULL):
+	# stack the frames into a single NCHW blob (each frame is resized to
+	# the same network input size, or the size a backend's model was
+	# exported with) and pass it through the network in one forward pass
+	size = getattr(net, "size", None) or size
+	start = metrics.time()
+	blob = cv2.dnn.blobFromImages(frames, 0.007843, size, 127.5)
+	metrics.observe("blob", start)
+	start = metrics.time()
+	net.setInput(blob)
+	detections = net.forward()
+	metrics.observe("forward", start)
+
+	# a single frame needs no routing
+	if len(frames) == 1:
+		return [detections]
+
+	# the SSD output is (1, 1, N, 7) for the whole batch and the first
+	# column holds the index of the image each detection belongs to, so
+	# split the rows back into one (1, 1, k, 7) array per frame -- the
+	# box coordinates are normalized and stay valid for each frame size
+	imageIDs = detections[0, 0, :, 0]
+	return [detections[:, :, imageIDs == i] for i in range(len(frames))]
+
+def decode(detections, W, H, confidence = 0.4, classID = PERSON, nms = None):
+	# flatten the raw (1, 1, N, 7) output to N rows of [imageID, classID,
+	# confidence, startX, startY, endX, endY] and keep the confident
+	# detections of the wanted class in one vectorized pass
+	rows = detections.reshape(-1, 7)
+	mask = (rows[:, 2] > confidence) & (rows[:, 1].astype("int") == classID)
+	rows = rows[mask]
+
+	# scale the normalized box coordinates back to the frame size
+	boxes = (rows[:, 3:7] * np.array([W, H, W, H])).astype("int")
+	confidences = rows[:, 2]
+
+	# optionally suppress overlapping boxes so the same person does not
+	# start several correlation trackers
+	if nms is not None and len(boxes) > 1:
+		xywh = np.column_stack((boxes[:, :2], boxes[:, 2:] - boxes[:, :2]))
+		keep = cv2.dnn.NMSBoxes(xywh.tolist(), confidences.tolist(), confidence, nms)
+		keep = np.array(keep, dtype = "int").reshape(-1)
+		boxes = boxes[keep]
+		confidences = confidences[keep]
+
+	# return the (M, 4) integer boxes along with their confidences
+	return (boxes, confidences)
@@ -0,0 +1,65 @@
+# import the necessary packages
+import cv2
+
+class MotionGate:
+	def __init__(self, method="mog2", width=160, threshold=0.002, crop=False, margin=20):
+		# detect motion on a small grayscale copy of the frame, either
+		# with a MOG2 background model or by differencing consecutive
+		# frames
+		if method not in ("mog2", "diff"):
+			raise ValueError("unknown motion method: {}".format(method))
+		self.method = method
+		self.width = width
+		self.subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+		self.previous = None
+
+		# fraction of the (small) frame that has to change to count as
+		# motion
+		self.threshold = threshold
+
+		# optionally crop the detector input to the moving region (plus
+		# a margin, in frame pixels) and the counting line
+		self.crop = crop
+		self.margin = margin
+
+		# number of frames checked and detections skipped
+		self.frames = 0
+		self.skipped = 0
+
+	def update(self, frame, lineY=None):
+		# returns whether something moved, along with the region of
+		# interest (x, y, w, h) for the detector when cropping
+		self.frames += 1
+		(H, W) = frame.shape[:2]
+		scale = self.width / float(W)
+		small = cv2.resize(frame, (self.width, max(1, int(H * scale))),
+			interpolation=cv2.INTER_AREA)
+		gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+		gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+		if self.method == "mog2":
+			mask = self.subtractor.apply(gray)
+		else:
+			if self.previous is None:
+				self.previous = gray
+			mask = cv2.absdiff(gray, self.previous)
+			self.previous = gray
+		mask = cv2.threshold(mask, 25, 255, cv2.THRESH_BINARY)[1]
+
+		moving = cv2.countNonZero(mask) >= self.threshold * mask.size
+		if not (moving and self.crop):
+			return (moving, None)
+
+		# scale the bounding box of the moving pixels back to the frame,
+		# add the margin and stretch it over the counting line
+		(x, y, w, h) = cv2.boundingRect(mask)
+		startX = max(0, int(x / scale) - self.margin)
+		startY = max(0, int(y / scale) - self.margin)
+		endX = min(W, int((x + w) / scale) + self.margin)
+		endY = min(H, int((y + h) / scale) + self.margin)
+		if lineY is not None:
+			startX = 0
+			endX = W
+			startY = max(0, min(startY, lineY - self.margin))
+			endY = min(H, max(endY, lineY + self.margin))
+		return (moving, (startX, startY, endX - startX, endY - startY))
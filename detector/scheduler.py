@@ -0,0 +1,87 @@
+# import the necessary packages
+from collections import Counter
+
+class DetectionScheduler:
+	def __init__(self, interval=30, minInterval=5, maxInterval=120,
+		adaptive=False, minConfidence=7.0, lineMargin=30):
+		# the regular number of frames between two detections, and the
+		# bounds the adaptive mode keeps the interval within
+		self.baseInterval = interval
+		self.minInterval = min(minInterval, interval)
+		self.maxInterval = max(maxInterval, interval)
+		self.interval = interval
+		self.adaptive = adaptive
+
+		# a tracker update below this confidence (dlib's peak-to-sidelobe
+		# ratio) or a person this close to the counting line asks for
+		# an early detection
+		self.minConfidence = minConfidence
+		self.lineMargin = lineMargin
+
+		# frames since the last detection (counting the upcoming one, so
+		# the detector runs every `interval` frames), whether an early
+		# detection was requested (and why) and the per-interval stats
+		self.since = None
+		self.reason = "start"
+		self.frames = 0
+		self.detections = 0
+		self.reasons = Counter()
+		self.intervals = Counter()
+
+	def due(self):
+		# check to see if we should run the more computationally
+		# expensive object detection on this frame
+		if self.since is None or self.since >= self.interval:
+			return True
+		return self.reason is not None and self.since >= self.minInterval
+
+	def update(self, detected, people, rects=(), confidences=(), lineY=None, motion=False):
+		# called once per frame with what the detector/trackers saw
+		self.frames += 1
+		if detected:
+			self.detections += 1
+			self.reasons[self.reason or "interval"] += 1
+			if self.since is not None:
+				self.intervals[self.since] += 1
+			self.since = 1
+			self.reason = None
+
+			# back off while the scene is empty and still, go back to
+			# the regular interval as soon as somebody shows up
+			if self.adaptive:
+				if people == 0 and not motion:
+					self.interval = min(self.maxInterval, self.interval * 2)
+				else:
+					self.interval = self.baseInterval
+			return
+
+		# nothing to count from until the first detection ran (the
+		# motion check may hold it back)
+		if self.since is None:
+			return
+		self.since += 1
+		if not self.adaptive or self.reason is not None:
+			return
+
+		# ask for an early detection when the trackers lose confidence,
+		# somebody is about to cross the counting line or something
+		# moves in an empty scene
+		if len(confidences) and min(confidences) < self.minConfidence:
+			self.reason = "low_confidence"
+		elif lineY is not None and any(abs((startY + endY) / 2 - lineY) < self.lineMargin
+			for (_, startY, _, endY) in rects):
+			self.reason = "near_line"
+		elif motion and people == 0:
+			self.reason = "motion"
+
+	def stats(self):
+		# detections per trigger and how long the intervals were
+		intervals = sum(k * v for (k, v) in self.intervals.items())
+		count = sum(self.intervals.values())
+		return {
+			"frames": self.frames,
+			"detections": self.detections,
+			"interval": self.interval,
+			"mean_interval": intervals / count if count else None,
+			"reasons": dict(self.reasons),
+		}
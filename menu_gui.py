@@ -6,12 +6,23 @@ import psutil
 import sqlite3
 from tkinter import ttk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from utils.store import StatsReader
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
+import datetime
 
 # Variable global para el proceso de la cámara
 camera_process = None
 
+# Lector de la base de datos compartido por todas las ventanas (una sola
+# conexión) y funciones de las ventanas abiertas que esperan filas nuevas
+reader = None
+listeners = []
+
+# Filas que conservan la tabla y las gráficas
+HISTORY = 1000
+
 def start_camera():
     """Inicia el contador de personas abriendo la cámara."""
     global camera_process
@@ -44,96 +55,201 @@ def stop_camera():
     else:
         status_label.config(text="La cámara no está activa")
 
+def poll_database():
+    """Consulta la base de datos una sola vez para todas las ventanas abiertas."""
+    global reader
+    try:
+        if reader is None:
+            reader = StatsReader("people_count.db", HISTORY)
+        # solo se avisa a las ventanas cuando el contador escribió filas nuevas
+        if reader.refresh():
+            for listener in list(listeners):
+                listener()
+    except sqlite3.Error as e:
+        print(f"Error al leer la base de datos: {e}")
+    root.after(2000, poll_database)
+
+def subscribe(window, listener):
+    """Avisa a la ventana de las filas nuevas hasta que se cierre."""
+    def unsubscribe(event):
+        # <Destroy> también llega por cada widget hijo de la ventana
+        if event.widget is window and listener in listeners:
+            listeners.remove(listener)
+
+    listeners.append(listener)
+    window.bind("<Destroy>", unsubscribe, add="+")
+    # llenar la ventana con las filas ya leídas
+    if reader is not None:
+        listener()
+
+def parse_datetime(text):
+    """Convierte la fecha de la base de datos al formato de matplotlib."""
+    return mdates.date2num(datetime.datetime.fromisoformat(text))
+
 def show_table():
     """Abre una ventana con la tabla mostrando los datos de la base de datos."""
+    last_id = 0
+
     def update_table():
-        """Actualiza la tabla con datos de la base de datos."""
-        for row in tree.get_children():
-            tree.delete(row)
-        try:
-            conn = sqlite3.connect("people_count.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT datetime, entries, exits FROM statistics ORDER BY id DESC LIMIT 10")
-            rows = cursor.fetchall()
-            for row in rows:
-                tree.insert("", "end", values=row)
-            conn.close()
-        except sqlite3.Error as e:
-            print(f"Error al leer la base de datos: {e}")
-        table_window.after(2000, update_table)
+        """Añade a la tabla solo las filas nuevas, las más recientes arriba."""
+        nonlocal last_id
+        rows = reader.since(last_id)
+        if not rows:
+            return
+        for row in rows:
+            tree.insert("", 0, values=(row[4],) + tuple(row[1:4]))
+        last_id = rows[-1][0]
+        # descartar las filas más antiguas
+        children = tree.get_children()
+        if len(children) > HISTORY:
+            tree.delete(*children[HISTORY:])
 
     # Crear la ventana para la tabla
     table_window = tk.Toplevel(root)
     table_window.title("Tabla - Base de Datos")
     table_window.geometry("500x300")
 
-    columns = ("datetime", "entries", "exits")
+    # cada cámara lleva sus propios totales, la columna dice de cuál es la fila
+    columns = ("camera", "datetime", "entries", "exits")
     tree = ttk.Treeview(table_window, columns=columns, show="headings")
+    tree.heading("camera", text="Cámara")
+    tree.column("camera", width=60, anchor=tk.CENTER)
     tree.heading("datetime", text="Fecha y Hora")
     tree.heading("entries", text="Entradas")
     tree.heading("exits", text="Salidas")
+    scrollbar = ttk.Scrollbar(table_window, orient=tk.VERTICAL, command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
     tree.pack(fill=tk.BOTH, expand=True)
 
-    # Actualizar tabla inicialmente
-    update_table()
+    # Llenar la tabla y actualizarla cuando lleguen filas nuevas
+    subscribe(table_window, update_table)
 
 def show_graph(graph_type):
     """Muestra la ventana con el gráfico del tipo seleccionado y actualiza automáticamente."""
+    last_id = 0
+    x, y_entries, y_exits, labels = [], [], [], []
+    # los totales son por cámara, la gráfica muestra los de la cámara elegida
+    cameras = []
+
+    def on_draw(event):
+        """Guarda el fondo sin las líneas tras cada dibujo completo (p. ej. al redimensionar)."""
+        nonlocal background
+        background = canvas.copy_from_bbox(fig.bbox)
+        for artist in animated:
+            ax.draw_artist(artist)
+
     def update_graph():
-        """Actualiza la gráfica dependiendo del tipo de gráfico seleccionado."""
-        try:
-            conn = sqlite3.connect("people_count.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT datetime, entries, exits FROM statistics ORDER BY id DESC LIMIT 10")
-            rows = cursor.fetchall()
-            rows.reverse()  # Ordenar por fecha ascendente
-            x = [row[0] for row in rows]
-            y_entries = [row[1] for row in rows]
-            y_exits = [row[2] for row in rows]
+        """Actualiza la gráfica solo con las filas nuevas."""
+        nonlocal last_id
+        rows = reader.since(last_id)
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        # añadir al selector las cámaras nuevas (la primera queda elegida)
+        new = sorted({row[4] for row in rows} - set(cameras))
+        if new:
+            cameras.extend(new)
+            cameras.sort()
+            camera_selector.config(values=cameras)
+            if not camera_selector.get():
+                camera_selector.set(cameras[0])
+        rows = [row for row in rows if str(row[4]) == camera_selector.get()]
+        if not rows:
+            return
+        x.extend(parse_datetime(row[1]) for row in rows)
+        labels.extend(row[1] for row in rows)
+        y_entries.extend(row[2] for row in rows)
+        y_exits.extend(row[3] for row in rows)
+        # conservar solo las últimas HISTORY filas
+        for values in (x, labels, y_entries, y_exits):
+            del values[:-HISTORY]
 
+        if graph_type == "line":
+            # mover los puntos de las líneas existentes; si caben en los
+            # ejes actuales basta con redibujar las líneas sobre el fondo
+            line_entries.set_data(x, y_entries)
+            line_exits.set_data(x, y_exits)
+            (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+            if background is not None and x0 <= x[0] and x[-1] <= x1 \
+                and y0 <= min(y_entries + y_exits) and max(y_entries + y_exits) <= y1:
+                canvas.restore_region(background)
+                for artist in animated:
+                    ax.draw_artist(artist)
+                canvas.blit(fig.bbox)
+                return
+            ax.relim()
+            ax.autoscale_view()
+        elif graph_type == "bar":
+            # las barras de las últimas 10 filas cambian de altura en su sitio
+            n = min(len(x), 10)
+            for (i, (bar_in, bar_out)) in enumerate(zip(bars_entries, bars_exits)):
+                bar_in.set_height(y_entries[i - n] if i < n else 0)
+                bar_out.set_height(y_exits[i - n] if i < n else 0)
+            ax.set_xticklabels(labels[-n:] + [""] * (10 - n), rotation=45)
+            ax.relim()
+            ax.autoscale_view()
+        elif graph_type == "hist":
             ax.clear()
-            if graph_type == "line":
-                ax.plot(x, y_entries, label="Entradas", color="blue")
-                ax.plot(x, y_exits, label="Salidas", color="red")
-                ax.set_title("Gráfico Lineal")
-            elif graph_type == "bar":
-                bar_width = 0.4
-                x_indices = np.arange(len(x))
-                ax.bar(x_indices - bar_width / 2, y_entries, bar_width, label="Entradas", color="blue")
-                ax.bar(x_indices + bar_width / 2, y_exits, bar_width, label="Salidas", color="red")
-                ax.set_xticks(x_indices)
-                ax.set_xticklabels(x, rotation=45)
-                ax.set_title("Gráfico de Barras")
-            elif graph_type == "hist":
-                ax.hist([y_entries, y_exits], bins=5, label=["Entradas", "Salidas"], color=["blue", "red"], alpha=0.7)
-                ax.set_title("Histograma")
-            elif graph_type == "pie":
-                total_entries = sum(y_entries)
-                total_exits = sum(y_exits)
-                ax.pie([total_entries, total_exits], labels=["Entradas", "Salidas"], autopct='%1.1f%%', colors=["blue", "red"])
-                ax.set_title("Gráfico de Pastel")
-
+            ax.hist([y_entries, y_exits], bins=5, label=["Entradas", "Salidas"], color=["blue", "red"], alpha=0.7)
+            ax.set_title("Histograma")
             ax.legend()
-            canvas.draw()
-            conn.close()
-        except sqlite3.Error as e:
-            print(f"Error al leer la base de datos: {e}")
-
-        # Reprogramar la actualización automática cada 2 segundos
-        graph_window.after(2000, update_graph)
+        elif graph_type == "pie":
+            ax.clear()
+            ax.pie([sum(y_entries[-10:]), sum(y_exits[-10:])], labels=["Entradas", "Salidas"], autopct='%1.1f%%', colors=["blue", "red"])
+            ax.set_title("Gráfico de Pastel")
+            ax.legend()
+        canvas.draw_idle()
 
     # Crear la ventana para la gráfica
     graph_window = tk.Toplevel(root)
     graph_window.title("Estadísticas - Gráfica")
     graph_window.geometry("700x500")
 
-    # Configurar la gráfica
+    def select_camera(event):
+        """Vuelve a dibujar la gráfica con las filas de la cámara elegida."""
+        nonlocal last_id
+        last_id = 0
+        for values in (x, labels, y_entries, y_exits):
+            del values[:]
+        update_graph()
+
+    # Selector de la cámara cuyos totales se muestran
+    selector_frame = tk.Frame(graph_window)
+    selector_frame.pack(fill=tk.X)
+    tk.Label(selector_frame, text="Cámara:").pack(side=tk.LEFT, padx=5)
+    camera_selector = ttk.Combobox(selector_frame, state="readonly", width=5)
+    camera_selector.pack(side=tk.LEFT, pady=5)
+    camera_selector.bind("<<ComboboxSelected>>", select_camera)
+
+    # Configurar la gráfica, los elementos se crean una vez y se actualizan
     fig, ax = plt.subplots(figsize=(6, 4))
     canvas = FigureCanvasTkAgg(fig, master=graph_window)
     canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    background = None
+    animated = []
+    if graph_type == "line":
+        (line_entries,) = ax.plot([], [], label="Entradas", color="blue", animated=True)
+        (line_exits,) = ax.plot([], [], label="Salidas", color="red", animated=True)
+        animated = [line_entries, line_exits]
+        ax.xaxis_date()
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%d/%m %H:%M"))
+        fig.autofmt_xdate()
+        ax.set_title("Gráfico Lineal")
+        ax.legend()
+        canvas.mpl_connect("draw_event", on_draw)
+    elif graph_type == "bar":
+        bar_width = 0.4
+        x_indices = np.arange(10)
+        bars_entries = ax.bar(x_indices - bar_width / 2, np.zeros(10), bar_width, label="Entradas", color="blue")
+        bars_exits = ax.bar(x_indices + bar_width / 2, np.zeros(10), bar_width, label="Salidas", color="red")
+        ax.set_xticks(x_indices)
+        ax.set_title("Gráfico de Barras")
+        ax.legend()
+    canvas.draw()
 
-    # Iniciar actualización automática de la gráfica
-    update_graph()
+    # Dibujar los datos y actualizar la gráfica cuando lleguen filas nuevas
+    subscribe(graph_window, update_graph)
 
 def select_graph_type():
     """Abre una ventana para seleccionar el tipo de gráfica antes de mostrarla."""
@@ -193,5 +309,8 @@ close_button.pack(pady=10)
 status_label = tk.Label(root, text="Estado: Inactivo", font=("Helvetica", 10))
 status_label.pack(pady=20)
 
+# Consultar la base de datos periódicamente para todas las ventanas
+poll_database()
+
 # Ejecutar el bucle principal de la interfaz
 root.mainloop()
@@ -1,46 +1,37 @@
-# python people_counter.py --prototxt detector/MobileNetSSD_deploy.prototxt --model detector/MobileNetSSD_deploy.caffemodel 
+# python people_counter.py --prototxt detector/MobileNetSSD_deploy.prototxt --model detector/MobileNetSSD_deploy.caffemodel
 
 from tracker.centroidtracker import CentroidTracker
 from tracker.trackableobject import TrackableObject
+from tracker.trackerpool import TrackerPool
+from tracker.zones import Zones
+from detector.scheduler import DetectionScheduler
+from detector.detector import decode, detect
+from detector import backends
+from detector.motion import MotionGate
 from imutils.video import VideoStream
-from itertools import zip_longest
-from utils.mailer import Mailer
+from utils.buffers import FramePool
+from utils.metrics import Metrics, NULL, serve, dump
+from utils.recorder import ClipRecorder
+from utils.scheduler import Schedule
+from utils.eventlog import EventLog
+from utils.store import EventStore, connect
 from imutils.video import FPS
+from utils import pipeline
+from utils import alerts
 from utils import thread
+import multiprocessing.pool
+import multiprocessing
 import numpy as np
 import threading
 import argparse
 import datetime
-import schedule
 import logging
-import imutils
+import signal
 import time
-import dlib
-import json	
-import csv
+import json
 import cv2
-import sqlite3
 import os
 
-if os.path.exists("people_count.db"):
-    os.remove("people_count.db")
-
-
-# Conexión a la base de datos
-conn = sqlite3.connect("people_count.db")
-cursor = conn.cursor()
-
-# Crear la tabla si no existe
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS statistics (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    datetime TEXT NOT NULL,
-    entries INTEGER NOT NULL,
-    exits INTEGER NOT NULL
-)
-""")
-conn.commit()
-
 # execution start time
 start_time = time.time()
 # setup logger
@@ -50,221 +41,552 @@ logger = logging.getLogger(__name__)
 with open("utils/config.json", "r") as file:
     config = json.load(file)
 
+# network loaded once per worker process by the pool initializer and
+# shared by every camera that worker handles
+worker_net = None
+
+# set on SIGINT/SIGTERM to stop the counter cleanly; people_counter()
+# swaps it for a multiprocessing.Event that the pool initializer hands to
+# the worker processes (they don't inherit it under the spawn/forkserver
+# start methods) so they can close their streams too
+stop_event = threading.Event()
+
+# per-stage latencies and gauges, the no-op NULL unless --metrics-port or
+# --metrics-json turn them on
+metrics = NULL
+
 def parse_arguments():
 	# function to parse the arguments
     ap = argparse.ArgumentParser()
     ap.add_argument("-p", "--prototxt", required=False,
         help="path to Caffe 'deploy' prototxt file")
     ap.add_argument("-m", "--model", required=True,
-        help="path to Caffe pre-trained model")
+        help="path to Caffe pre-trained model (or an ONNX/OpenVINO export)")
     ap.add_argument("-i", "--input", type=str,
         help="path to optional input video file")
     ap.add_argument("-o", "--output", type=str,
         help="path to optional output video file")
     # confidence default 0.4
+    ap.add_argument("--backend", type=str, default="opencv", choices=backends.BACKENDS,
+        help="inference engine running the detector (onnxruntime/openvino need an .onnx model)")
+    ap.add_argument("--precision", type=str, default="fp32", choices=backends.PRECISIONS,
+        help="detector precision (int8: quantized with onnxruntime, or a quantized OpenVINO IR)")
+    ap.add_argument("--dnn-threads", type=int, default=0,
+        help="# of threads of the inference engine (0 = its default)")
     ap.add_argument("-c", "--confidence", type=float, default=0.4,
         help="minimum probability to filter weak detections")
     ap.add_argument("-s", "--skip-frames", type=int, default=30,
         help="# of skip frames between detections")
+    # resolutions of the detector, the counting/display frame, the
+    # trackers and the output video
+    ap.add_argument("--inference-size", type=str, default="300x300",
+        help="detector input size WxH (MobileNet-SSD was trained at 300x300), "
+        "'frame' for the frame's own size")
+    ap.add_argument("--width", type=int, default=500,
+        help="width of the frame people are tracked, counted and shown in")
+    ap.add_argument("--tracker-scale", type=float, default=1.0,
+        help="scale of the frame the dlib trackers run on, relative to --width")
+    ap.add_argument("--tracker-gray", action="store_true",
+        help="run the dlib trackers on a grayscale frame")
+    ap.add_argument("--output-size", type=str, default="frame", choices=["frame", "full"],
+        help="write the --output video/clips at the counting frame size or the source resolution")
+    # evidence clips around the crossings instead of the whole session
+    ap.add_argument("--clips", type=str, default=None,
+        help="folder to save short clips around the crossings in")
+    ap.add_argument("--clip-on", type=str, default="crossing", choices=["crossing", "alert"],
+        help="record a clip around every crossing or only around threshold alerts")
+    ap.add_argument("--pre-roll", type=float, default=5.0,
+        help="seconds kept in memory and saved before the event")
+    ap.add_argument("--post-roll", type=float, default=5.0,
+        help="seconds saved after the last event of a clip")
+    ap.add_argument("--adaptive", action="store_true",
+        help="adapt the skip frames to the scene (within --min-skip/--max-skip)")
+    ap.add_argument("--min-skip", type=int, default=5,
+        help="min. # of skip frames between detections in adaptive mode")
+    ap.add_argument("--max-skip", type=int, default=120,
+        help="max. # of skip frames between detections in adaptive mode")
+    ap.add_argument("--motion", type=str, default=None, choices=["mog2", "diff"],
+        help="skip detections in an empty scene while nothing moves")
+    ap.add_argument("--motion-crop", action="store_true",
+        help="only pass the moving region and the counting line to the detector")
+    ap.add_argument("--nms", type=float, default=None,
+        help="optional overlap threshold to suppress duplicate person boxes")
+    ap.add_argument("-a", "--assignment", type=str, default="greedy",
+        choices=["greedy", "hungarian"],
+        help="how the centroid tracker matches detections to tracked people")
+    ap.add_argument("--tracker-workers", type=int, default=1,
+        help="# of threads/processes updating the dlib trackers on skip frames")
+    ap.add_argument("--tracker-mode", type=str, default="process",
+        choices=["thread", "process"],
+        help="run the parallel tracker updates in processes or in threads (dlib holds the GIL)")
+    # multi-camera mode (overrides config["Cameras"])
+    ap.add_argument("--cameras", type=str, nargs="+",
+        help="list of camera urls/indexes or video files to count in parallel")
+    ap.add_argument("-w", "--workers", type=int, default=0,
+        help="# of worker processes for multi-camera mode (0 = one per core)")
+    ap.add_argument("--headless", action="store_true",
+        help="no preview window, only draw overlays for the --output video")
+    # pipelined single-camera mode
+    ap.add_argument("--pipeline", action="store_true",
+        help="run capture, detection/tracking, counting and rendering as overlapping stages")
+    ap.add_argument("--queue-size", type=int, default=4,
+        help="# of frames queued between two pipeline stages")
+    ap.add_argument("--drop-policy", type=str, default=pipeline.DROP_OLD,
+        choices=pipeline.POLICIES,
+        help="what to do with live frames when the pipeline falls behind")
+    # offline mode for recorded footage
+    ap.add_argument("--offline", action="store_true",
+        help="count an --input video as fast as possible in parallel chunks")
+    ap.add_argument("--chunks", type=int, default=0,
+        help="# of chunks the video is split into in offline mode (0 = one per worker)")
+    ap.add_argument("--overlap", type=float, default=5.0,
+        help="seconds each offline chunk starts early to pick up people already in view")
+    ap.add_argument("--start", type=str, default=None,
+        help="recording start (YYYY-MM-DD HH:MM:SS) for offline event times "
+        "(default: file modification time minus the video length)")
+    # metrics export (off by default)
+    ap.add_argument("--metrics-port", type=int, default=0,
+        help="serve per-stage metrics on this local port (Prometheus format at /metrics)")
+    ap.add_argument("--metrics-json", type=str, default=None,
+        help="path of a JSON file the metrics are written to periodically")
+    ap.add_argument("--metrics-interval", type=float, default=10.0,
+        help="seconds between two --metrics-json writes")
     args = vars(ap.parse_args())
+    if args["offline"] and not args["input"]:
+        ap.error("--offline needs an --input video")
+    # unsupported backend/precision pairs before any worker loads the model
+    error = backends.check(args["backend"], args["precision"], args["model"])
+    if error is not None:
+        ap.error(error)
+    if args["offline"] and args["output"] is not None:
+        # every chunk worker would write its own frames into the same file
+        ap.error("--offline doesn't write an --output video, count without --offline to record one")
+    if args["inference_size"] == "frame":
+        args["inference_size"] = None
+    else:
+        try:
+            args["inference_size"] = tuple(int(v) for v in args["inference_size"].split("x"))
+        except ValueError:
+            ap.error("--inference-size takes WxH (e.g. 300x300) or 'frame'")
+    if not 0 < args["tracker_scale"] <= 1:
+        ap.error("--tracker-scale must be in (0, 1]")
     return args
 
-def send_mail():
-	# function to send the email alerts
-	Mailer().send(config["Email_Receive"])
+def load_network(args, threads = 0):
+	# load our serialized model from disk on the chosen inference engine
+	# (workers pass their share of the cores as the default thread count)
+	return backends.load_network(args["model"], args["prototxt"], args["backend"],
+		args["precision"], args["dnn_threads"] or threads)
 
-def log_data(move_in, in_time, move_out, out_time):
-	# function to log the counting data
-	data = [move_in, in_time, move_out, out_time]
-	# transpose the data to align the columns properly
-	export_data = zip_longest(*data, fillvalue = '')
+def parse_source(source):
+	# webcam indexes come in as strings from the command line
+	if isinstance(source, str) and source.isdigit():
+		return int(source)
+	return source
 
-	with open('utils/data/logs/counting_data.csv', 'w', newline = '') as myfile:
-		wr = csv.writer(myfile, quoting = csv.QUOTE_ALL)
-		if myfile.tell() == 0: # check if header rows are already existing
-			wr.writerow(("Move In", "In Time", "Move Out", "Out Time"))
-			wr.writerows(export_data)
+def handle_signal(signum, frame):
+	# stop on SIGINT/SIGTERM (e.g. from systemd) instead of the `q` key
+	logger.info("Stopping the counter.. (signal {})".format(signum))
+	# set from another thread: the main thread may be waiting on the
+	# event, and multiprocessing.Event.set() waits for the waiters to wake
+	threading.Thread(target = stop_event.set, daemon = True).start()
 
-def people_counter():
-	# main function for people_counter.py
-	args = parse_arguments()
-	# initialize the list of class labels MobileNet SSD was trained to detect
-	CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
-		"bottle", "bus", "car", "cat", "chair", "cow", "diningtable",
-		"dog", "horse", "motorbike", "person", "pottedplant", "sheep",
-		"sofa", "train", "tvmonitor"]
+def start_metrics(args):
+	# turn the stage metrics on if an export was asked for (the worker
+	# processes each export their own, on the next free port and in a
+	# file with their pid)
+	global metrics
+	if not args["metrics_port"] and not args["metrics_json"]:
+		return
+	metrics = Metrics()
+	if args["metrics_port"]:
+		serve(metrics, args["metrics_port"])
+	if args["metrics_json"]:
+		path = args["metrics_json"]
+		if multiprocessing.parent_process() is not None:
+			(root, ext) = os.path.splitext(path)
+			path = "{}_{}{}".format(root, os.getpid(), ext)
+		dump(metrics, path, args["metrics_interval"])
 
-	# load our serialized model from disk
-	net = cv2.dnn.readNetFromCaffe(args["prototxt"], args["model"])
+def start_alerts():
+	# one alert dispatcher per process when the alerts are on, None otherwise
+	if not config["ALERT"]:
+		return None
+	return alerts.from_config(config)
 
-	# if a video path was not supplied, grab a reference to the ip camera
-	if not args.get("input", False):
-		logger.info("Starting the live stream..")
-		vs = VideoStream(config["url"]).start()
-		time.sleep(2.0)
+class StreamCounter:
+	""" Counting state of a single camera/video source. """
 
-	# otherwise, grab a reference to the video file
-	else:
-		logger.info("Starting the video..")
-		vs = cv2.VideoCapture(args["input"])
-
-	# initialize the video writer (we'll instantiate later if need be)
-	writer = None
-
-	# initialize the frame dimensions (we'll set them as soon as we read
-	# the first frame from the video)
-	W = None
-	H = None
-
-	# instantiate our centroid tracker, then initialize a list to store
-	# each of our dlib correlation trackers, followed by a dictionary to
-	# map each unique object ID to a TrackableObject
-	ct = CentroidTracker(maxDisappeared=40, maxDistance=50)
-	trackers = []
-	trackableObjects = {}
-
-	# initialize the total number of frames processed thus far, along
-	# with the total number of objects that have moved either up or down
-	totalFrames = 0
-	totalDown = 0
-	totalUp = 0
-	# initialize empty lists to store the counting data
-	total = []
-	move_out = []
-	move_in =[]
-	out_time = []
-	in_time = []
-
-	# start the frames per second throughput estimator
-	fps = FPS().start()
-
-	if config["Thread"]:
-		vs = thread.ThreadingClass(config["url"])
-
-	# loop over frames from the video stream
-	while True:
+	def __init__(self, args, store, source, camera_id = 0, is_file = False, blocking = None,
+		offline = False, alerts = None):
+		self.args = args
+		self.store = store
+		# sends the threshold alerts in the background (None when off)
+		self.alerts = alerts
+		self.source = source
+		self.camera_id = camera_id
+		self.is_file = is_file
+		# offline chunks only collect their crossings: no log, overlays or
+		# alerts (the parent writes the stitched crossings)
+		self.offline = offline
+		# video files (and the pipeline's capture stage) read every frame
+		# straight from cv2.VideoCapture
+		self.blocking = is_file if blocking is None else blocking
+
+		# if we are reading a video file, grab a reference to it
+		if is_file:
+			logger.info("Starting the video.. (camera {})".format(camera_id))
+			self.vs = cv2.VideoCapture(source)
+		elif self.blocking:
+			logger.info("Starting the live stream.. (camera {})".format(camera_id))
+			self.vs = cv2.VideoCapture(source)
+		# otherwise, grab a reference to the ip camera
+		elif config["Thread"]:
+			logger.info("Starting the live stream.. (camera {})".format(camera_id))
+			self.vs = thread.ThreadingClass(source)
+		else:
+			logger.info("Starting the live stream.. (camera {})".format(camera_id))
+			self.vs = VideoStream(source).start()
+			time.sleep(2.0)
+
+		# initialize the video writer (we'll instantiate later if need be)
+		self.writer = None
+
+		# initialize the frame dimensions (we'll set them as soon as we read
+		# the first frame from the video)
+		self.W = None
+		self.H = None
+
+		# instantiate our centroid tracker, then initialize a pool to run
+		# each of our dlib correlation trackers, followed by a dictionary to
+		# map each unique object ID to a TrackableObject
+		self.ct = CentroidTracker(maxDisappeared=40, maxDistance=50,
+			method=args["assignment"])
+		self.trackers = TrackerPool(args["tracker_workers"], args["tracker_mode"])
+		self.trackableObjects = {}
+
+		# counting lines/polygons of this camera from the config, without
+		# any the single horizontal line in the middle of the frame
+		zones = [zone for zone in config.get("Zones", [])
+			if zone.get("camera", camera_id) == camera_id]
+		self.zones = Zones(zones) if zones else None
+
+		# reusable buffers the frames are decoded, resized and converted
+		# into (in shared memory when the trackers run in other processes)
+		self.frames = FramePool(shared = self.trackers.shared)
+		self.trackers.frames = self.frames
+		self.shape = None
+		self.frame = None
+		self.rgb = None
+		# the decoded frame, kept for a full resolution output video
+		self.raw = None
+		self.full = args["output_size"] == "full" and (args["output"] is not None
+			or (args["clips"] is not None and not offline))
+
+		# evidence clips: the last pre-roll seconds stay in memory and
+		# are only encoded (in the recorder's thread) around a crossing
+		self.recorder = None
+		self.crossed = False
+		if args["clips"] is not None and not offline:
+			self.recorder = ClipRecorder(args["clips"], "camera{}".format(camera_id),
+				self.source_fps(), args["pre_roll"], args["post_roll"], block = is_file)
+
+		# capture time of the current frame, and the time from capture
+		# until its crossings were counted (summed over all frames)
+		self.captured = None
+		self.latency = 0.0
+		self.max_latency = 0.0
+
+		# decide which frames run the detector, every skip_frames or
+		# adapted to the scene
+		self.scheduler = DetectionScheduler(args["skip_frames"], args["min_skip"],
+			args["max_skip"], adaptive=args["adaptive"])
+
+		# optional cheap motion check ahead of the detector
+		self.motion = None
+		if args["motion"] is not None:
+			self.motion = MotionGate(args["motion"], crop=args["motion_crop"])
+
+		# initialize the total number of frames processed thus far, along
+		# with the total number of objects that have moved either up or down
+		self.totalFrames = 0
+		self.totalDown = 0
+		self.totalUp = 0
+		# initialize the people inside (shown once somebody entered)
+		self.total = []
+
+		# initiate a simple log to save the counting data
+		self.log = None
+		if config["Log"] and not offline:
+			self.log = EventLog(name = self.log_name, fmt = config.get("Log_Format", "csv"),
+				max_size = config.get("Log_Max_MB", 0) * 1024 * 1024)
+
+		# start the frames per second throughput estimator
+		self.fps = FPS().start()
+		self.started = time.time()
+
+		# export the gauges of this stream along with the stage metrics
+		metrics.collect(self.collect)
+
+	@property
+	def drawing(self):
+		# overlays are only drawn on the counting frame when somebody gets
+		# to see them, either in the preview window or in the output video
+		# (a full resolution output gets its own)
+		if self.offline:
+			return False
+		recording = self.args["output"] is not None or self.recorder is not None
+		return not self.args["headless"] or (recording and not self.full)
+
+	@property
+	def line_y(self):
+		# the counting line the detection scheduler and motion crop keep
+		# an eye on (none with zones)
+		return self.H // 2 if self.zones is None else None
+
+	@property
+	def window_name(self):
+		# one preview window per camera in multi-camera mode
+		if self.args.get("cameras"):
+			return "Monitorización en Tiempo Real - {}".format(self.camera_id)
+		return "Monitorización en Tiempo Real"
+
+	@property
+	def log_name(self):
+		# one log per camera in multi-camera mode
+		if self.args.get("cameras"):
+			return 'counting_data_{}'.format(self.camera_id)
+		return 'counting_data'
+
+	def source_fps(self):
+		# the frame rate the video/camera reports, for the output video
+		# and the clips (30 when it reports none)
+		cap = self.vs.cap if isinstance(self.vs, thread.ThreadingClass) else self.vs
+		fps = cap.get(cv2.CAP_PROP_FPS) if isinstance(cap, cv2.VideoCapture) else 0
+		return fps if 0 < fps < 1000 else 30.0
+
+	def read(self):
+		# time the wait for the next frame
+		start = metrics.time()
+		frame = self._read()
+		metrics.observe("capture", start, self.camera_id)
+		return frame
+
+	def _read(self):
 		# grab the next frame and handle if we are reading from either
 		# VideoCapture or VideoStream
-		frame = vs.read()
-		frame = frame[1] if args.get("input", False) else frame
+		if isinstance(self.vs, thread.ThreadingClass):
+			# wait a bounded time, so a stalled camera (while it
+			# reconnects) doesn't hold up the other streams or the stop
+			# signal, and keep the capture time of the frame
+			frame = self.vs.read(timeout = 1.0)
+			self.captured = self.vs.timestamp
+			return frame
+		self.captured = time.time()
+		if not self.blocking:
+			return self.vs.read()
 
-		# if we are viewing a video and we did not grab a frame then we
-		# have reached the end of the video
-		if args["input"] is not None and frame is None:
-			break
+		# VideoCapture decodes straight into a reusable buffer once the
+		# frame size is known
+		buffer = self.frames.acquire(self.shape) if self.shape else None
+		(grabbed, frame) = self.vs.read(buffer)
+		if frame is not buffer:
+			self.frames.release(buffer)
+		if not grabbed:
+			return None
+		self.shape = frame.shape
+		return frame
+
+	def record(self, direction, objectID, zone = None):
+		# queue the crossing for the background database writer and
+		# append it to the log
+		self.store.add(direction, objectID, self.totalDown, self.totalUp,
+			self.camera_id, zone = zone)
+		self.crossed = True
+		if self.log is not None:
+			self.log.add(direction, objectID, self.totalDown, self.totalUp,
+				self.camera_id)
 
+	def resize(self, frame):
 		# resize the frame to have a maximum width of 500 pixels (the
 		# less data we have, the faster we can process it), then convert
-		# the frame from BGR to RGB for dlib
-		frame = imutils.resize(frame, width = 500)
-		rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+		# the frame from BGR to RGB for dlib -- both written into pooled
+		# buffers instead of new arrays
+		start = metrics.time()
+		(h, w) = frame.shape[:2]
+		width = self.args["width"]
+		size = (width, int(h * width / float(w)))
+		small = self.frames.acquire((size[1], size[0], 3))
+		cv2.resize(frame, size, dst = small, interpolation = cv2.INTER_AREA)
+
+		# the dlib trackers can run on a further downscaled and/or
+		# grayscale copy
+		image = small
+		scale = self.args["tracker_scale"]
+		if scale != 1.0:
+			tracked = (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+			image = self.frames.acquire((tracked[1], tracked[0], 3))
+			cv2.resize(small, tracked, dst = image, interpolation = cv2.INTER_AREA)
+		if self.args["tracker_gray"]:
+			rgb = self.frames.acquire(image.shape[:2])
+			cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst = rgb)
+		else:
+			rgb = self.frames.acquire(image.shape)
+			cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst = rgb)
+		if image is not small:
+			self.frames.release(image)
 
 		# if the frame dimensions are empty, set them
-		if W is None or H is None:
-			(H, W) = frame.shape[:2]
+		if self.W is None or self.H is None:
+			(self.H, self.W) = small.shape[:2]
+		metrics.observe("resize", start, self.camera_id)
+		return (small, rgb)
 
-		# if we are supposed to be writing a video to disk, initialize
-		# the writer
-		if args["output"] is not None and writer is None:
-			fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-			writer = cv2.VideoWriter(args["output"], fourcc, 30,
-				(W, H), True)
+	def keep(self, frame):
+		# the decoded frame is only kept for a full resolution output,
+		# otherwise it is done with once resized (frames of a
+		# VideoStream/ThreadingClass belong to the stream)
+		if self.full:
+			return frame
+		if self.blocking:
+			self.frames.release(frame)
+		return None
+
+	def blob_size(self, image):
+		# the detector input size, the configured one or the image's own
+		return self.args["inference_size"] or image.shape[1::-1]
 
+	def prepare(self, frame):
+		# the previous frame has been shown and written by now
+		self.frames.release(self.frame, self.rgb, self.raw if self.blocking else None)
+		(self.frame, self.rgb) = self.resize(frame)
+		self.raw = self.keep(frame)
+
+		# check to see if we should run a more computationally expensive
+		# object detection method to aid our tracker (the caller batches
+		# the detection frames of all its streams into one forward pass)
+		self.detecting = self.scheduler.due()
+		(self.detecting, self.roi, self.moving) = self.gate(self.frame, self.detecting)
+		return self.detecting
+
+	def gate(self, frame, detecting):
+		# run the motion check (on every frame, to keep the background
+		# model current), skip the detection when nothing moves in an
+		# empty scene and pick the region the detector should look at
+		if self.motion is None:
+			return (detecting, None, False)
+		(moving, roi) = self.motion.update(frame, self.line_y)
+		if detecting and not moving and not len(self.trackers):
+			self.motion.skipped += 1
+			detecting = False
+		return (detecting, roi, moving)
+
+	def crop(self, frame, roi = None):
+		# the part of the frame passed to the detector
+		if roi is None:
+			return frame
+		(x, y, w, h) = roi
+		return frame[y:y + h, x:x + w]
+
+	def track(self, rgb, detections = None, roi = None, moving = False):
 		# initialize the current status along with our list of bounding
 		# box rectangles returned by either (1) our object detector or
 		# (2) the correlation trackers
 		status = "Waiting"
 		rects = []
+		confidences = []
+		# scale of the trackers' frame relative to the counting frame
+		sx = rgb.shape[1] / float(self.W)
+		sy = rgb.shape[0] / float(self.H)
 
-		# check to see if we should run a more computationally expensive
-		# object detection method to aid our tracker
-		if totalFrames % args["skip_frames"] == 0:
+		# run the detections through our new set of object trackers
+		if detections is not None:
 			# set the status and initialize our new set of object trackers
 			status = "Detecting"
-			trackers = []
-
-			# convert the frame to a blob and pass the blob through the
-			# network and obtain the detections
-			blob = cv2.dnn.blobFromImage(frame, 0.007843, (W, H), 127.5)
-			net.setInput(blob)
-			detections = net.forward()
-
-			# loop over the detections
-			for i in np.arange(0, detections.shape[2]):
-				# extract the confidence (i.e., probability) associated
-				# with the prediction
-				confidence = detections[0, 0, i, 2]
-
-				# filter out weak detections by requiring a minimum
-				# confidence
-				if confidence > args["confidence"]:
-					# extract the index of the class label from the
-					# detections list
-					idx = int(detections[0, 0, i, 1])
-
-					# if the class label is not a person, ignore it
-					if CLASSES[idx] != "person":
-						continue
-
-					# compute the (x, y)-coordinates of the bounding box
-					# for the object
-					box = detections[0, 0, i, 3:7] * np.array([W, H, W, H])
-					(startX, startY, endX, endY) = box.astype("int")
-
-					# construct a dlib rectangle object from the bounding
-					# box coordinates and then start the dlib correlation
-					# tracker
-					tracker = dlib.correlation_tracker()
-					rect = dlib.rectangle(startX, startY, endX, endY)
-					tracker.start_track(rgb, rect)
-
-					# add the tracker to our list of trackers so we can
-					# utilize it during skip frames
-					trackers.append(tracker)
+
+			# keep the confident person detections and compute the
+			# (x, y)-coordinates of their bounding boxes
+			start = metrics.time()
+			(x, y, w, h) = roi or (0, 0, self.W, self.H)
+			(boxes, _) = decode(detections, w, h, self.args["confidence"],
+				nms = self.args["nms"])
+			boxes += (x, y, x, y)
+			metrics.observe("decode", start, self.camera_id)
+
+			# start a dlib correlation tracker on each of them so we can
+			# utilize them during skip frames (on the tracker's frame)
+			start = metrics.time()
+			self.trackers.start(rgb, (boxes * (sx, sy, sx, sy)).astype("int").tolist())
+			metrics.observe("tracker_start", start, self.camera_id)
 
 		# otherwise, we should utilize our object *trackers* rather than
 		# object *detectors* to obtain a higher frame processing throughput
-		else:
-			# loop over the trackers
-			for tracker in trackers:
-				# set the status of our system to be 'tracking' rather
-				# than 'waiting' or 'detecting'
-				status = "Tracking"
-
-				# update the tracker and grab the updated position
-				tracker.update(rgb)
-				pos = tracker.get_position()
-
-				# unpack the position object
-				startX = int(pos.left())
-				startY = int(pos.top())
-				endX = int(pos.right())
-				endY = int(pos.bottom())
-
-				# add the bounding box coordinates to the rectangles list
-				rects.append((startX, startY, endX, endY))
-
-		# draw a horizontal line in the center of the frame -- once an
-		# object crosses this line we will determine whether they were
-		# moving 'up' or 'down'
-		cv2.line(frame, (0, H // 2), (W, H // 2), (0, 0, 0), 3)
-		cv2.putText(frame, "-Prediction border - Entrance-", (10, H - ((i * 20) + 200)),
-			cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+		elif len(self.trackers):
+			# set the status of our system to be 'tracking' rather
+			# than 'waiting' or 'detecting'
+			status = "Tracking"
+
+			# update the trackers (in parallel with --tracker-workers) and
+			# grab the updated bounding box coordinates
+			start = metrics.time()
+			(rects, confidences) = self.trackers.update(rgb)
+			if (sx, sy) != (1.0, 1.0):
+				rects = [(int(startX / sx), int(startY / sy), int(endX / sx), int(endY / sy))
+					for (startX, startY, endX, endY) in rects]
+			metrics.observe("tracker_update", start, self.camera_id)
+
+		# let the scheduler pick the next detection frame
+		self.scheduler.update(detections is not None, len(self.trackers),
+			rects, confidences, self.line_y, moving)
+		return (status, rects)
+
+	def count(self, rects):
+		# set by record() when somebody crossed in this frame
+		self.crossed = False
 
 		# use the centroid tracker to associate the (1) old object
 		# centroids with (2) the newly computed object centroids
-		objects = ct.update(rects)
+		start = metrics.time()
+		objects = self.ct.update(rects)
+		metrics.observe("centroid", start, self.camera_id)
+		start = metrics.time()
+
+		# alert is set when this frame pushed the people inside over the
+		# threshold
+		if self.zones is not None:
+			alert = self.cross_zones()
+		else:
+			alert = self.cross_line(objects)
+
+		# forget the objects the centroid tracker has deregistered
+		for objectID in self.ct.deregistered:
+			self.trackableObjects.pop(objectID, None)
+
+		# flush the log every few seconds
+		if self.log is not None:
+			self.log.poll()
+
+		# hand back a snapshot of the objects so the frame can be drawn
+		# while the tracker moves on to the next one
+		metrics.observe("count", start, self.camera_id)
+		return (list(objects.items()), alert)
+
+	def cross_line(self, objects):
+		# count the objects crossing the horizontal line in the middle of
+		# the frame
+		H = self.H
+		alert = False
 
 		# loop over the tracked objects
 		for (objectID, centroid) in objects.items():
 			# check to see if a trackable object exists for the current
 			# object ID
-			to = trackableObjects.get(objectID, None)
+			to = self.trackableObjects.get(objectID, None)
 
 			# if there is no existing trackable object, create one
 			if to is None:
 				to = TrackableObject(objectID, centroid)
-				
+
 			# otherwise, there is a trackable object so we can utilize it
 			# to determine direction
 			else:
@@ -272,9 +594,7 @@ def people_counter():
 				# centroid and the mean of *previous* centroids will tell
 				# us in which direction the object is moving (negative for
 				# 'up' and positive for 'down')
-				y = [c[1] for c in to.centroids]
-				direction = centroid[1] - np.mean(y)
-				to.centroids.append(centroid)
+				direction = to.update(centroid)
 
 				# check to see if the object has been counted or not
 				if not to.counted:
@@ -282,63 +602,123 @@ def people_counter():
 					# is moving up) AND the centroid is above the center
 					# line, count the object
 					if direction < 0 and centroid[1] < H // 2:
-						totalUp += 1
-						date_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-						move_out.append(totalUp)
-						out_time.append(date_time)
+						self.totalUp += 1
 						to.counted = True
-
-						# Insertar datos en SQLite
-						cursor.execute('INSERT INTO statistics (datetime, entries, exits) VALUES (?, ?, ?)', 
-							(date_time, len(move_in), len(move_out)))
-						conn.commit()
+						self.record("out", objectID)
 
 					elif direction > 0 and centroid[1] > H // 2:
-						totalDown += 1
-						date_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-						move_in.append(totalDown)
-						in_time.append(date_time)
+						self.totalDown += 1
 						to.counted = True
-
-						# Insertar datos en SQLite
-						cursor.execute('INSERT INTO statistics (datetime, entries, exits) VALUES (?, ?, ?)', 
-							(date_time, len(move_in), len(move_out)))
-						conn.commit()
+						self.record("in", objectID)
 
 						# if the people limit exceeds over threshold, send an email alert
-						if sum(total) >= config["Threshold"]:
-							cv2.putText(frame, "-ALERT: People limit exceeded-", (10, frame.shape[0] - 80),
-								cv2.FONT_HERSHEY_COMPLEX, 0.5, (0, 0, 255), 2)
-							if config["ALERT"]:
-								logger.info("Sending email alert..")
-								email_thread = threading.Thread(target = send_mail)
-								email_thread.daemon = True
-								email_thread.start()
-								logger.info("Alert sent!")
+						if self.threshold():
+							alert = True
 						to.counted = True
 						# compute the sum of total people inside
-						total = []
-						total.append(len(move_in) - len(move_out))
+						self.total = []
+						self.total.append(self.totalDown - self.totalUp)
 
 			# store the trackable object in our dictionary
-			trackableObjects[objectID] = to
+			self.trackableObjects[objectID] = to
+		return alert
 
+	def cross_zones(self):
+		# test every tracked object against all the configured zones at
+		# once; the lines add up to the entries/exits of the camera, the
+		# polygons only keep their own counters
+		alert = False
+		events = self.zones.update(self.ct.ids, self.ct.centroids, self.W, self.H)
+		for (zone, direction, objectID) in events:
+			if zone not in self.zones.line_names:
+				continue
+			if direction == "in":
+				self.totalDown += 1
+				self.record("in", objectID, zone)
+				if self.threshold():
+					alert = True
+			else:
+				self.totalUp += 1
+				self.record("out", objectID, zone)
+			self.total = [self.totalDown - self.totalUp]
+		return alert
+
+	def threshold(self):
+		# True when the people inside (before this entry) reached the
+		# threshold, the alert goes out if the alerts are on
+		if sum(self.total) < config["Threshold"]:
+			return False
+		if self.alerts is not None and not self.offline:
+			# repeated alerts of this camera are rate limited and
+			# coalesced by the dispatcher
+			inside = self.totalDown - self.totalUp
+			self.alerts.send("threshold:{}".format(self.camera_id), "ALERT!",
+				"People limit exceeded in your building! {} people inside "
+				"(camera {}, limit {}).".format(inside, self.camera_id,
+				config["Threshold"]), camera = self.camera_id, inside = inside)
+			logger.info("Alert queued..")
+		return True
+
+	def idle(self):
+		# nothing is tracked and no detection is due, so the next frame
+		# would only age the objects of the centroid tracker (with the
+		# motion check every frame is needed)
+		return (self.W is not None and self.motion is None and not len(self.trackers)
+			and not self.scheduler.due())
+
+	def skip(self):
+		# account for a frame that was not decoded, same as an empty frame
+		self.scheduler.update(False, 0)
+		self.count([])
+		self.totalFrames += 1
+		self.fps.update()
+
+	def counted(self, captured):
+		# time from capturing the frame until its crossings were counted
+		latency = time.time() - captured
+		self.latency += latency
+		self.max_latency = max(self.max_latency, latency)
+
+	def render(self, frame, status, objects, alert = False):
+		start = metrics.time()
+		# the frame is the counting frame or the full resolution one, the
+		# object centroids are scaled to it
+		(H, W) = frame.shape[:2]
+		sx = W / float(self.W)
+		sy = H / float(self.H)
+
+		if self.zones is not None:
+			self.render_zones(frame)
+		else:
+			# draw a horizontal line in the center of the frame -- once an
+			# object crosses this line we will determine whether they were
+			# moving 'up' or 'down'
+			cv2.line(frame, (0, H // 2), (W, H // 2), (0, 0, 0), 3)
+			cv2.putText(frame, "-Prediction border - Entrance-", (10, H - 200),
+				cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+
+		if alert:
+			cv2.putText(frame, "-ALERT: People limit exceeded-", (10, frame.shape[0] - 80),
+				cv2.FONT_HERSHEY_COMPLEX, 0.5, (0, 0, 255), 2)
+
+		for (objectID, centroid) in objects:
 			# draw both the ID of the object and the centroid of the
 			# object on the output frame
 			text = "ID {}".format(objectID)
-			cv2.putText(frame, text, (centroid[0] - 10, centroid[1] - 10),
+			(x, y) = (int(centroid[0] * sx), int(centroid[1] * sy))
+			cv2.putText(frame, text, (x - 10, y - 10),
 				cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-			cv2.circle(frame, (centroid[0], centroid[1]), 4, (255, 255, 255), -1)
+			cv2.circle(frame, (x, y), 4, (255, 255, 255), -1)
 
 		# construct a tuple of information we will be displaying on the frame
 		info_status = [
-		("Exit", totalUp),
-		("Enter", totalDown),
+		("Exit", self.totalUp),
+		("Enter", self.totalDown),
 		("Status", status),
 		]
 
 		info_total = [
-		("Total people inside", ', '.join(map(str, total))),
+		("Total people inside", ', '.join(map(str, self.total))),
 		]
 
 		# display the output
@@ -349,53 +729,566 @@ def people_counter():
 		for (i, (k, v)) in enumerate(info_total):
 			text = "{}: {}".format(k, v)
 			cv2.putText(frame, text, (265, H - ((i * 20) + 60)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+		metrics.observe("render", start, self.camera_id)
+		return frame
 
-		# initiate a simple log to save the counting data
-		if config["Log"]:
-			log_data(move_in, in_time, move_out, out_time)
+	def render_zones(self, frame):
+		# draw the counting lines and zones with their counters
+		(H, W) = frame.shape[:2]
+		for zone in self.zones.lines:
+			(a, b) = [(int(x * W), int(y * H)) for (x, y) in zone["line"]]
+			counts = self.zones.counts[zone["name"]]
+			cv2.line(frame, a, b, (0, 0, 0), 3)
+			cv2.putText(frame, "{}: in {} out {}".format(zone["name"], counts["in"], counts["out"]),
+				(min(a[0], b[0]) + 5, min(a[1], b[1]) - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+		for zone in self.zones.polygons:
+			points = np.array([(x * W, y * H) for (x, y) in zone["polygon"]], dtype="int32")
+			counts = self.zones.counts[zone["name"]]
+			cv2.polylines(frame, [points], True, (0, 255, 255), 2)
+			cv2.putText(frame, "{}: {} inside".format(zone["name"], counts["occupancy"]),
+				tuple(points.min(axis=0) + [5, 15]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
 
+	def write(self, frame):
 		# check to see if we should write the frame to disk
-		if writer is not None:
-			writer.write(frame)
+		if self.args["output"] is None:
+			return
+
+		# if we are supposed to be writing a video to disk, initialize
+		# the writer
+		if self.writer is None:
+			fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+			output = self.args["output"]
+			if self.args.get("cameras"):
+				root, ext = os.path.splitext(output)
+				output = "{}_{}{}".format(root, self.camera_id, ext)
+			self.writer = cv2.VideoWriter(output, fourcc, self.source_fps(),
+				frame.shape[1::-1], True)
+		start = metrics.time()
+		self.writer.write(frame)
+		metrics.observe("write", start, self.camera_id)
+
+	def clip(self, frame, crossed, alert = False):
+		# keep the frame for the evidence clips, starting (or extending)
+		# one when somebody crossed in it, or only on an alert
+		if self.recorder is None:
+			return
+		start = metrics.time()
+		if alert or (crossed and self.args["clip_on"] == "crossing"):
+			self.recorder.trigger("alert" if alert else "crossing")
+		self.recorder.add(frame)
+		metrics.observe("clip", start, self.camera_id)
+
+	def collect(self):
+		# gauges of this stream, read when the metrics are exported
+		labels = {"camera": self.camera_id}
+		elapsed = max(time.time() - self.started, 1e-6)
+		gauges = [
+			("frames", labels, self.totalFrames),
+			("fps", labels, self.totalFrames / elapsed),
+			("active_tracks", labels, len(self.ct.ids)),
+			("trackers", labels, len(self.trackers)),
+			("entries", labels, self.totalDown),
+			("exits", labels, self.totalUp),
+			("latency_seconds", labels, self.latency / max(self.totalFrames, 1)),
+		]
+		if isinstance(self.vs, thread.ThreadingClass):
+			gauges += [("capture_dropped", labels, self.vs.dropped),
+				("capture_reconnects", labels, self.vs.reconnects)]
+		if self.zones is not None:
+			for (name, counts) in self.zones.counts.items():
+				zone = dict(labels, zone = name)
+				gauges += [("zone_entries", zone, counts["in"]), ("zone_exits", zone, counts["out"]),
+					("zone_occupancy", zone, counts["occupancy"])]
+		return gauges
+
+	def update(self, detections = None):
+		# the detections of the frame are passed in when prepare()
+		# flagged it as a detection frame
+		(status, rects) = self.track(self.rgb, detections if self.detecting else None,
+			self.roi, self.moving)
+		(objects, alert) = self.count(rects)
+		self.counted(self.captured)
+		frame = self.frame
+		if self.drawing:
+			self.render(frame, status, objects, alert)
+		if self.full:
+			self.render(self.raw, status, objects, alert)
+		self.write(self.raw if self.full else frame)
+		self.clip(self.raw if self.full else frame, self.crossed, alert)
 
-		# show the output frame
-		cv2.imshow("Monitorización en Tiempo Real", frame)
-		key = cv2.waitKey(1) & 0xFF
-		# if the `q` key was pressed, break from the loop
-		if key == ord("q"):
-			break
 		# increment the total number of frames processed thus far and
 		# then update the FPS counter
-		totalFrames += 1
-		fps.update()
+		self.totalFrames += 1
+		self.fps.update()
+		return frame
+
+	def close(self):
+		# stop the timer and display FPS information
+		self.fps.stop()
+		logger.info("Camera {} elapsed time: {:.2f}".format(self.camera_id, self.fps.elapsed()))
+		logger.info("Camera {} approx. FPS: {:.2f}".format(self.camera_id, self.fps.fps()))
+		logger.info("Camera {} detections: {}".format(self.camera_id, self.scheduler.stats()))
+		if self.motion is not None:
+			logger.info("Camera {} detections skipped without motion: {}".format(
+				self.camera_id, self.motion.skipped))
+		if self.totalFrames:
+			logger.info("Camera {} capture to count latency: {:.1f} ms mean, {:.1f} ms max".format(
+				self.camera_id, 1000 * self.latency / self.totalFrames, 1000 * self.max_latency))
+		if isinstance(self.vs, thread.ThreadingClass):
+			logger.info("Camera {} capture: {}".format(self.camera_id, self.vs.stats()))
+		if self.zones is not None:
+			logger.info("Camera {} zones: {}".format(self.camera_id, self.zones.counts))
 
-		# initiate the timer
-		if config["Timer"]:
+		if self.writer is not None:
+			self.writer.release()
+		if self.recorder is not None:
+			self.recorder.close()
+			logger.info("Camera {} clips: {}".format(self.camera_id, self.recorder.stats()))
+
+		if self.log is not None:
+			self.log.close()
+
+		self.trackers.close()
+		metrics.discard(self.collect)
+		logger.info("Camera {} frame buffers: {}".format(self.camera_id, self.frames.stats()))
+		self.frames.close()
+
+		# release the camera device/resource (issue 15)
+		if self.blocking or config["Thread"]:
+			self.vs.release()
+		else:
+			self.vs.stop()
+
+def count_streams(args, net, cameras):
+	# count every (camera_id, source, is_file) in this process, round-robin
+	# over the streams so they all share the same loaded network
+	store = EventStore(metrics = metrics)
+	dispatcher = start_alerts()
+	counters = [StreamCounter(args, store, source, camera_id, is_file, alerts = dispatcher)
+		for (camera_id, source, is_file) in cameras]
+
+	# loop over frames from the video streams
+	while counters:
+		ready = []
+		for counter in list(counters):
+			frame = counter.read()
+
+			# if we are viewing a video and we did not grab a frame then we
+			# have reached the end of the video
+			if frame is None:
+				if counter.is_file:
+					counter.close()
+					counters.remove(counter)
+				continue
+
+			counter.prepare(frame)
+			ready.append(counter)
+
+		# convert the frames of every stream that reached a detection
+		# frame into a single blob, pass it through the network and
+		# route the detections back to each stream
+		detecting = [counter for counter in ready if counter.detecting]
+		results = {}
+		if detecting:
+			images = [counter.crop(counter.frame, counter.roi) for counter in detecting]
+			detections = detect(net, images, detecting[0].blob_size(images[0]), metrics)
+			results = dict(zip(detecting, detections))
+
+		for counter in ready:
+			frame = counter.update(results.get(counter))
+
+			# show the output frame
+			if not args["headless"]:
+				cv2.imshow(counter.window_name, frame)
+
+		if not args["headless"]:
+			key = cv2.waitKey(1) & 0xFF
+			# if the `q` key was pressed, break from the loop
+			if key == ord("q"):
+				break
+		# wait a moment for the live streams to deliver a frame
+		elif not ready:
+			stop_event.wait(0.005)
+
+		# stop on SIGINT/SIGTERM
+		if stop_event.is_set():
+			break
+
+		# stop at the end of the scheduled window
+		if args.get("stop_at") and time.time() >= args["stop_at"]:
+			break
+
+		# initiate the timer (the scheduler's windows replace it)
+		if config["Timer"] and not args.get("stop_at"):
 			# automatic timer to stop the live stream (set to 8 hours/28800s)
 			end_time = time.time()
 			num_seconds = (end_time - start_time)
 			if num_seconds > 28800:
 				break
 
-	# stop the timer and display FPS information
-	fps.stop()
-	logger.info("Elapsed time: {:.2f}".format(fps.elapsed()))
-	logger.info("Approx. FPS: {:.2f}".format(fps.fps()))
-
-	# release the camera device/resource (issue 15)
-	if config["Thread"]:
-		vs.release()
+	for counter in counters:
+		counter.close()
 
 	# close any open windows
-	cv2.destroyAllWindows()
-
-# initiate the scheduler
-if config["Scheduler"]:
-	# runs at every day (09:00 am)
-	schedule.every().day.at("13:00").do(people_counter)
-	while True:
-		schedule.run_pending()
-else:
-	people_counter()
+	if not args["headless"]:
+		cv2.destroyAllWindows()
+	store.close()
+	if dispatcher is not None:
+		dispatcher.close()
+
+def count_pipeline(args, net, camera):
+	# count a single stream with capture, preprocessing, detection and
+	# tracking, counting and rendering/encoding overlapping in threads
+	(camera_id, source, is_file) = camera
+	store = EventStore(metrics = metrics)
+	dispatcher = start_alerts()
+	counter = StreamCounter(args, store, source, camera_id, is_file, blocking = True,
+		alerts = dispatcher)
+	size = args["queue_size"]
+
+	def preprocess(packet):
+		raw = packet.frame
+		(packet.frame, packet.rgb) = counter.resize(raw)
+		packet.raw = counter.keep(raw)
+		return packet
+
+	def infer(packet):
+		# check to see if we should run a more computationally expensive
+		# object detection method to aid our tracker
+		detections = None
+		(detecting, roi, moving) = counter.gate(packet.frame, counter.scheduler.due())
+		if detecting:
+			image = counter.crop(packet.frame, roi)
+			detections = detect(net, [image], counter.blob_size(image), metrics)[0]
+		(packet.status, packet.rects) = counter.track(packet.rgb, detections, roi, moving)
+		return packet
+
+	def count(packet):
+		(packet.objects, packet.alert) = counter.count(packet.rects)
+		packet.crossed = counter.crossed
+		counter.counted(packet.captured)
+		counter.totalFrames += 1
+		return packet
+
+	def render(packet):
+		if counter.drawing:
+			counter.render(packet.frame, packet.status, packet.objects, packet.alert)
+		if counter.full:
+			counter.render(packet.raw, packet.status, packet.objects, packet.alert)
+
+		# show the output frame
+		if not args["headless"]:
+			cv2.imshow(counter.window_name, packet.frame)
+			key = cv2.waitKey(1) & 0xFF
+			# if the `q` key was pressed, stop the stream
+			if key == ord("q"):
+				stream.stop()
+
+		# stop on SIGINT/SIGTERM
+		if stop_event.is_set():
+			stream.stop()
+
+		# stop at the end of the scheduled window
+		if args.get("stop_at") and time.time() >= args["stop_at"]:
+			stream.stop()
+
+		# initiate the timer (the scheduler's windows replace it)
+		if config["Timer"] and not args.get("stop_at"):
+			# automatic timer to stop the live stream (set to 8 hours/28800s)
+			if time.time() - start_time > 28800:
+				stream.stop()
+		counter.fps.update()
+		return packet
+
+	def encode(packet):
+		counter.write(packet.raw if counter.full else packet.frame)
+		counter.clip(packet.raw if counter.full else packet.frame, packet.crossed, packet.alert)
+		release(packet)
+
+	def release(packet):
+		# hand the buffers of a finished (or dropped) frame back
+		counter.frames.release(packet.frame, getattr(packet, "rgb", None),
+			getattr(packet, "raw", None))
+
+	# never drop frames of a video file, live cameras fall back on the
+	# drop policy so the counter keeps up with the latest frames
+	policy = pipeline.BLOCK if is_file else args["drop_policy"]
+	stages = [
+		pipeline.Stage("preprocess", preprocess, size, policy),
+		pipeline.Stage("detect/track", infer, size),
+		pipeline.Stage("count", count, size),
+		pipeline.Stage("render", render, size, policy, main = True),
+		pipeline.Stage("encode", encode, size),
+	]
+	stream = pipeline.Pipeline(counter.read, stages, release)
+	metrics.collect(stream.gauges)
+	stream.run()
+	metrics.discard(stream.gauges)
+	stream.report()
+
+	counter.close()
+	if not args["headless"]:
+		cv2.destroyAllWindows()
+	store.close()
+	if dispatcher is not None:
+		dispatcher.close()
+
+class Crossings(list):
+	""" Collects the crossings of an offline chunk in place of the EventStore. """
+
+	def __init__(self):
+		super().__init__()
+		# index of the frame being counted
+		self.frame = 0
+
+	def add(self, direction, track_id, entries, exits, camera = 0, timestamp = None, zone = None):
+		self.append((self.frame, direction, track_id, zone))
+
+def count_chunk(args, source, first, start, stop):
+	# count the frames first..stop of a video file, where first..start
+	# only warms the trackers up (its crossings belong to the chunk
+	# before) -- returns the crossings, frames counted and frames decoded
+	crossings = Crossings()
+	counter = StreamCounter(args, crossings, source, is_file = True, offline = True)
+	counter.vs.set(cv2.CAP_PROP_POS_FRAMES, first)
+	decoded = 0
+
+	index = first
+	while index < stop and not stop_event.is_set():
+		crossings.frame = index
+		# skip decoding frames nobody would look at (grab() without
+		# retrieve() only demuxes them)
+		if counter.idle():
+			if not counter.vs.grab():
+				break
+			counter.skip()
+		else:
+			frame = counter.read()
+			if frame is None:
+				break
+			decoded += 1
+			detections = None
+			if counter.prepare(frame):
+				image = counter.crop(counter.frame, counter.roi)
+				detections = detect(worker_net, [image], counter.blob_size(image), metrics)[0]
+			counter.update(detections)
+		index += 1
+
+	counter.close()
+	return ([c for c in crossings if c[0] >= start], index - first, decoded)
+
+def count_offline(args, source):
+	# count a recorded video many times faster than real time: split it
+	# into chunks counted in parallel, then stitch the crossings together
+	cap = cv2.VideoCapture(source)
+	total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+	rate = cap.get(cv2.CAP_PROP_FPS) or 30.0
+	cap.release()
+
+	# each chunk starts --overlap seconds early, so people already in
+	# view when it starts get a track history before its own frames; a
+	# chunk is kept at least a few times longer than the overlap
+	warmup = int(args["overlap"] * rate)
+	workers = args["workers"] or os.cpu_count() or 1
+	chunks = args["chunks"] or workers
+	if total > 0:
+		chunks = max(1, min(chunks, total // max(1, 4 * warmup)))
+		bounds = [total * i // chunks for i in range(chunks + 1)]
+	else:
+		# unknown length, count it in one go
+		(chunks, bounds) = (1, [0, float("inf")])
+	workers = min(workers, chunks)
+	threads = max(1, (os.cpu_count() or 1) // workers)
+	# the warm-up starts on a frame the single pass detects on, so every
+	# chunk follows the same detection schedule and the stitched counts
+	# don't depend on --chunks (exactly so without --adaptive/--motion)
+	skip = max(1, args["skip_frames"])
+	jobs = [(args, source, max(0, bounds[i] - warmup) // skip * skip, bounds[i], bounds[i + 1])
+		for i in range(chunks)]
+	logger.info("Counting {} in {} chunks with {} workers..".format(source, chunks, workers))
+
+	started = time.time()
+	with WorkerPool(workers, initializer = init_worker,
+		initargs = (args, threads, stop_event)) as pool:
+		results = pool.starmap(count_chunk, jobs)
+	elapsed = time.time() - started
+
+	# order the crossings by frame, give the tracks of every chunk their
+	# own IDs and recompute the running entries/exits
+	if args["start"] is not None:
+		begin = datetime.datetime.fromisoformat(args["start"]).timestamp()
+	else:
+		begin = os.path.getmtime(source) - max(total, 0) / rate
+	events = sorted((frame, chunk, direction, objectID, zone)
+		for (chunk, (crossings, _, _)) in enumerate(results)
+		for (frame, direction, objectID, zone) in crossings)
+	store = EventStore(metrics = metrics)
+	log = None
+	if config["Log"]:
+		log = EventLog(fmt = config.get("Log_Format", "csv"),
+			max_size = config.get("Log_Max_MB", 0) * 1024 * 1024)
+	ids = {}
+	(entries, exits) = (0, 0)
+	for (frame, chunk, direction, objectID, zone) in events:
+		trackID = ids.setdefault((chunk, objectID), len(ids))
+		if direction == "in":
+			entries += 1
+		else:
+			exits += 1
+		timestamp = begin + frame / rate
+		store.add(direction, trackID, entries, exits, 0, timestamp, zone)
+		if log is not None:
+			log.add(direction, trackID, entries, exits, 0, timestamp)
+	if log is not None:
+		log.close()
+	store.close()
+
+	# throughput, counting the warm-up frames only once
+	frames = sum(r[1] for r in results) - sum(job[3] - job[2] for job in jobs)
+	decoded = sum(r[2] for r in results)
+	logger.info("In: {}, Out: {}".format(entries, exits))
+	logger.info("Processed {} frames ({} decoded) in {:.2f}s: {:.1f} frames/sec, {:.1f}x real time".format(
+		frames, decoded, elapsed, frames / max(elapsed, 1e-6),
+		frames / rate / max(elapsed, 1e-6)))
+
+class WorkerProcess(multiprocessing.Process):
+	""" Pool worker that may start processes of its own (the tracker shards). """
+
+	# the pool makes its workers daemonic, which forbids children; the
+	# workers are still closed and joined by the pool before we exit
+	@property
+	def daemon(self):
+		return False
+
+	@daemon.setter
+	def daemon(self, value):
+		pass
+
+class WorkerPool(multiprocessing.pool.Pool):
+	""" multiprocessing.Pool of WorkerProcess workers. """
+
+	@staticmethod
+	def Process(ctx, *args, **kwds):
+		return WorkerProcess(*args, **kwds)
+
+def init_worker(args, threads, event):
+	# load the network once for this worker process and split the
+	# OpenCV thread pool between the workers to avoid oversubscription
+	global worker_net, stop_event
+	# the parent process handles Ctrl+C and tells the workers to stop
+	# through its stop_event
+	stop_event = event
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	cv2.setNumThreads(threads)
+	worker_net = load_network(args, threads)
+	start_metrics(args)
+
+def run_worker(args, cameras):
+	count_streams(args, worker_net, cameras)
+
+def run_cameras(args, sources):
+	# function to count several cameras in a pool of worker processes
+	cameras = [(camera_id, parse_source(source), os.path.isfile(str(source)))
+		for (camera_id, source) in enumerate(sources)]
+
+	# size the pool to the cores (or --workers), the workers keep their
+	# network loaded from one scheduled window to the next
+	workers = args["workers"] or os.cpu_count() or 1
+	workers = min(workers, len(cameras))
+	threads = max(1, (os.cpu_count() or 1) // workers)
+
+	def count(active):
+		# deal the cameras out round-robin, each worker then loops over
+		# its share of the streams
+		groups = [active[i::workers] for i in range(workers)]
+		logger.info("Counting {} cameras with {} workers..".format(len(active), workers))
+		pool.starmap(run_worker, [(args, group) for group in groups if group])
+
+	# bring the database up to date once here rather than in every
+	# worker's EventStore at the same time (the migrations are locked, but
+	# the workers would all queue up on the rollup backfill)
+	connect("people_count.db").close()
+
+	with WorkerPool(workers, initializer = init_worker,
+		initargs = (args, threads, stop_event)) as pool:
+		run_scheduled(args, cameras, count)
 
-conn.close()
\ No newline at end of file
+def run_scheduled(args, cameras, count):
+	# count the (camera_id, source, is_file) cameras with count(cameras),
+	# with the scheduler on only the ones inside their configured windows,
+	# sleeping until the next window opens in between
+	if not config["Scheduler"]:
+		count(cameras)
+		return
+
+	schedule = Schedule.from_config(config.get("Schedule", []))
+	ids = [camera[0] for camera in cameras]
+	while not stop_event.is_set():
+		now = datetime.datetime.now()
+		active = schedule.active(now, ids)
+		change = schedule.next_change(now, ids)
+		if not active:
+			if change is None:
+				logger.info("Nothing scheduled, waiting for Ctrl+C..")
+			else:
+				logger.info("Sleeping until {}..".format(change.strftime("%a %Y-%m-%d %H:%M")))
+			# wakes up right away on SIGINT/SIGTERM
+			stop_event.wait(None if change is None else (change - now).total_seconds())
+			continue
+
+		# count until the next window opens or closes
+		logger.info("Scheduled window: cameras {} until {}".format(active,
+			"further notice" if change is None else change.strftime("%a %Y-%m-%d %H:%M")))
+		args["stop_at"] = None if change is None else change.timestamp()
+		count([camera for camera in cameras if camera[0] in active])
+
+		# a stream that ended early (end of a video, `q` pressed) is done
+		# for this window
+		if change is not None and datetime.datetime.now() < change:
+			stop_event.wait((change - datetime.datetime.now()).total_seconds())
+
+def people_counter():
+	# main function for people_counter.py
+	args = parse_arguments()
+
+	# stop cleanly on Ctrl+C or `systemctl stop`, created here (not on
+	# import) so it belongs to the start method in use
+	global stop_event
+	stop_event = multiprocessing.Event()
+	signal.signal(signal.SIGINT, handle_signal)
+	signal.signal(signal.SIGTERM, handle_signal)
+
+	# several camera sources are counted in parallel worker processes
+	sources = args["cameras"] or config.get("Cameras", [])
+	if sources and not args.get("input", False):
+		args["cameras"] = sources
+		run_cameras(args, sources)
+		return
+
+	# recorded footage is counted in parallel chunks
+	if args["offline"]:
+		count_offline(args, args["input"])
+		return
+
+	# the network stays loaded between scheduled windows
+	start_metrics(args)
+	net = load_network(args)
+
+	# if a video path was not supplied, grab a reference to the ip camera
+	# otherwise, grab a reference to the video file
+	if not args.get("input", False):
+		camera = (0, config["url"], False)
+	else:
+		camera = (0, args["input"], True)
+
+	def count(cameras):
+		if args["pipeline"]:
+			count_pipeline(args, net, cameras[0])
+		else:
+			count_streams(args, net, cameras)
+
+	run_scheduled(args, [camera], count)
+
+if __name__ == "__main__":
+	people_counter()
@@ -1,17 +1,27 @@
 # import the necessary packages
+from scipy.sparse.csgraph import connected_components
+from scipy.optimize import linear_sum_assignment
 from scipy.spatial import distance as dist
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
 from collections import OrderedDict
 import numpy as np
 
 class CentroidTracker:
-	def __init__(self, maxDisappeared=50, maxDistance=50):
-		# initialize the next unique object ID along with two ordered
-		# dictionaries used to keep track of mapping a given object
-		# ID to its centroid and number of consecutive frames it has
-		# been marked as "disappeared", respectively
+	def __init__(self, maxDisappeared=50, maxDistance=50, method="greedy", gateSize=256):
+		# initialize the next unique object ID along with the arrays
+		# used to keep track of each object ID (sorted, as IDs only
+		# grow), its centroid and the number of consecutive frames it
+		# has been marked as "disappeared" -- row i of each array
+		# belongs to the same object
 		self.nextObjectID = 0
-		self.objects = OrderedDict()
-		self.disappeared = OrderedDict()
+		self.ids = np.empty(0, dtype="int")
+		self.centroids = np.empty((0, 2), dtype="int")
+		self.missing = np.empty(0, dtype="int")
+
+		# IDs deregistered during the last update, so the caller can
+		# drop whatever else it keeps about them
+		self.deregistered = []
 
 		# store the number of maximum consecutive frames a given
 		# object is allowed to be marked as "disappeared" until we
@@ -23,141 +33,210 @@ class CentroidTracker:
 		# distance we'll start to mark the object as "disappeared"
 		self.maxDistance = maxDistance
 
+		# how to solve the assignment: "greedy" (closest pairs first)
+		# or "hungarian" (optimal, scipy's linear_sum_assignment)
+		if method not in ("greedy", "hungarian"):
+			raise ValueError("unknown assignment method: {}".format(method))
+		self.method = method
+
+		# with more tracked objects than this, only the pairs closer
+		# than maxDistance (found with a KD-tree) are considered, and
+		# each cluster of nearby objects is solved on its own
+		self.gateSize = gateSize
+
+	@property
+	def objects(self):
+		# map each object ID to its centroid
+		return OrderedDict(zip(self.ids.tolist(), self.centroids.tolist()))
+
+	@property
+	def disappeared(self):
+		# map each object ID to its consecutive "disappeared" frames
+		return OrderedDict(zip(self.ids.tolist(), self.missing.tolist()))
+
 	def register(self, centroid):
 		# when registering an object we use the next available object
 		# ID to store the centroid
-		self.objects[self.nextObjectID] = centroid
-		self.disappeared[self.nextObjectID] = 0
-		self.nextObjectID += 1
+		self._register(np.array([centroid], dtype="int"))
+
+	def _register(self, centroids):
+		# register a batch of new centroids with consecutive IDs
+		count = len(centroids)
+		newIDs = np.arange(self.nextObjectID, self.nextObjectID + count)
+		self.ids = np.concatenate((self.ids, newIDs))
+		self.centroids = np.concatenate((self.centroids, centroids))
+		self.missing = np.concatenate((self.missing, np.zeros(count, dtype="int")))
+		self.nextObjectID += count
 
 	def deregister(self, objectID):
-		# to deregister an object ID we delete the object ID from
-		# both of our respective dictionaries
-		del self.objects[objectID]
-		del self.disappeared[objectID]
+		# to deregister an object ID we delete its row (IDs are sorted
+		# so we can binary search for it)
+		row = np.searchsorted(self.ids, objectID)
+		if row == len(self.ids) or self.ids[row] != objectID:
+			raise KeyError(objectID)
+		self._keep(np.arange(len(self.ids)) != row)
+		self.deregistered.append(objectID)
+
+	def _keep(self, mask):
+		# keep only the rows selected by the boolean mask
+		self.ids = self.ids[mask]
+		self.centroids = self.centroids[mask]
+		self.missing = self.missing[mask]
+
+	def _age(self, rows):
+		# mark the given rows as disappeared for one more frame and
+		# deregister the objects that have been missing for too long
+		self.missing[rows] += 1
+		expired = self.missing > self.maxDisappeared
+		if expired.any():
+			self.deregistered.extend(self.ids[expired].tolist())
+			self._keep(~expired)
+
+	def _solve(self, D):
+		# match rows (objects) to columns (input centroids), ignoring
+		# pairs further apart than the maximum distance
+		if self.method == "hungarian":
+			# forbid the far away pairs with a cost no valid matching
+			# can reach, then keep the valid part of the assignment
+			cost = np.where(D > self.maxDistance, 1e6 + D.max(), D)
+			(rows, cols) = linear_sum_assignment(cost)
+			valid = D[rows, cols] <= self.maxDistance
+			return (rows[valid], cols[valid])
+
+		# in order to perform this matching we must (1) find the
+		# smallest value in each row and then (2) sort the row
+		# indexes based on their minimum values so that the row
+		# with the smallest value as at the *front* of the index
+		# list
+		rows = D.min(axis=1).argsort()
+
+		# next, we perform a similar process on the columns by
+		# finding the smallest value in each column and then
+		# sorting using the previously computed row index list
+		cols = D.argmin(axis=1)[rows]
+
+		# keep track of which of the rows and column indexes we have
+		# already examined
+		usedRows = np.zeros(D.shape[0], dtype="bool")
+		usedCols = np.zeros(D.shape[1], dtype="bool")
+		matches = []
+
+		# loop over the combination of the (row, column) index
+		# tuples
+		for (row, col) in zip(rows.tolist(), cols.tolist()):
+			# if we have already examined either the row or column
+			# value before, or the centroids are too far apart,
+			# ignore it
+			if usedRows[row] or usedCols[col] or D[row, col] > self.maxDistance:
+				continue
+			usedRows[row] = True
+			usedCols[col] = True
+			matches.append((row, col))
+
+		matches = np.array(matches, dtype="int").reshape(-1, 2)
+		return (matches[:, 0], matches[:, 1])
+
+	def _match(self, inputCentroids):
+		# with only a few objects the full distance matrix is cheap
+		if len(self.ids) <= self.gateSize:
+			return self._solve(dist.cdist(self.centroids, inputCentroids))
+
+		# otherwise find the candidate pairs within the maximum distance
+		# with KD-trees (padded a little as the trees leave out pairs
+		# right at the limit) -- objects and inputs that are not linked
+		# by any candidate pair cannot be matched at all
+		pairs = cKDTree(self.centroids).sparse_distance_matrix(
+			cKDTree(inputCentroids), self.maxDistance + 1e-6, output_type="ndarray")
+		pairs = pairs[pairs["v"] <= self.maxDistance]
+		if len(pairs) == 0:
+			empty = np.empty(0, dtype="int")
+			return (empty, empty)
+
+		# split the candidates into independent clusters (connected
+		# components of the bipartite object/input graph)
+		n = len(self.ids)
+		size = n + len(inputCentroids)
+		graph = coo_matrix((np.ones(len(pairs)), (pairs["i"], n + pairs["j"])),
+			shape=(size, size))
+		(_, labels) = connected_components(graph, directed=False)
+		objectLabels = labels[:n]
+		inputLabels = labels[n:]
+		objectCounts = np.bincount(objectLabels, minlength=size)
+		inputCounts = np.bincount(inputLabels, minlength=size)
+		smallest = np.minimum(objectCounts, inputCounts)
+
+		# most clusters have a single object or a single input, both
+		# methods then simply take the closest pair of the cluster, so
+		# those are matched all at once
+		pairLabels = objectLabels[pairs["i"]]
+		simple = np.flatnonzero(smallest[pairLabels] == 1)
+		order = simple[np.lexsort((pairs["v"][simple], pairLabels[simple]))]
+		(_, first) = np.unique(pairLabels[order], return_index=True)
+		best = order[first]
+		allRows = [pairs["i"][best].astype("int")]
+		allCols = [pairs["j"][best].astype("int")]
+
+		# the crowded clusters are solved on their own small distance
+		# matrices
+		crowded = np.flatnonzero(smallest > 1)
+		if len(crowded):
+			objectOrder = np.argsort(objectLabels, kind="stable")
+			inputOrder = np.argsort(inputLabels, kind="stable")
+			objectBounds = np.searchsorted(objectLabels[objectOrder], [crowded, crowded + 1])
+			inputBounds = np.searchsorted(inputLabels[inputOrder], [crowded, crowded + 1])
+			for (i, label) in enumerate(crowded):
+				objectRows = objectOrder[objectBounds[0, i]:objectBounds[1, i]]
+				inputCols = inputOrder[inputBounds[0, i]:inputBounds[1, i]]
+				D = dist.cdist(self.centroids[objectRows], inputCentroids[inputCols])
+				(rows, cols) = self._solve(D)
+				allRows.append(objectRows[rows])
+				allCols.append(inputCols[cols])
+		return (np.concatenate(allRows), np.concatenate(allCols))
 
 	def update(self, rects):
+		# start a fresh list of the IDs deregistered by this update
+		self.deregistered = []
+
 		# check to see if the list of input bounding box rectangles
 		# is empty
 		if len(rects) == 0:
-			# loop over any existing tracked objects and mark them
-			# as disappeared
-			for objectID in list(self.disappeared.keys()):
-				self.disappeared[objectID] += 1
-
-				# if we have reached a maximum number of consecutive
-				# frames where a given object has been marked as
-				# missing, deregister it
-				if self.disappeared[objectID] > self.maxDisappeared:
-					self.deregister(objectID)
+			# mark all existing tracked objects as disappeared and
+			# deregister the ones that have reached the maximum number
+			# of consecutive missing frames
+			self._age(np.arange(len(self.ids)))
 
 			# return early as there are no centroids or tracking info
 			# to update
 			return self.objects
 
-		# initialize an array of input centroids for the current frame
-		inputCentroids = np.zeros((len(rects), 2), dtype="int")
-
-		# loop over the bounding box rectangles
-		for (i, (startX, startY, endX, endY)) in enumerate(rects):
-			# use the bounding box coordinates to derive the centroid
-			cX = int((startX + endX) / 2.0)
-			cY = int((startY + endY) / 2.0)
-			inputCentroids[i] = (cX, cY)
+		# use the bounding box coordinates to derive the input
+		# centroids for the current frame
+		rects = np.asarray(rects, dtype="float")
+		inputCentroids = ((rects[:, :2] + rects[:, 2:]) / 2.0).astype("int")
 
 		# if we are currently not tracking any objects take the input
 		# centroids and register each of them
-		if len(self.objects) == 0:
-			for i in range(0, len(inputCentroids)):
-				self.register(inputCentroids[i])
-
-		# otherwise, are are currently tracking objects so we need to
-		# try to match the input centroids to existing object
-		# centroids
-		else:
-			# grab the set of object IDs and corresponding centroids
-			objectIDs = list(self.objects.keys())
-			objectCentroids = list(self.objects.values())
-
-			# compute the distance between each pair of object
-			# centroids and input centroids, respectively -- our
-			# goal will be to match an input centroid to an existing
-			# object centroid
-			D = dist.cdist(np.array(objectCentroids), inputCentroids)
-
-			# in order to perform this matching we must (1) find the
-			# smallest value in each row and then (2) sort the row
-			# indexes based on their minimum values so that the row
-			# with the smallest value as at the *front* of the index
-			# list
-			rows = D.min(axis=1).argsort()
-
-			# next, we perform a similar process on the columns by
-			# finding the smallest value in each column and then
-			# sorting using the previously computed row index list
-			cols = D.argmin(axis=1)[rows]
-
-			# in order to determine if we need to update, register,
-			# or deregister an object we need to keep track of which
-			# of the rows and column indexes we have already examined
-			usedRows = set()
-			usedCols = set()
-
-			# loop over the combination of the (row, column) index
-			# tuples
-			for (row, col) in zip(rows, cols):
-				# if we have already examined either the row or
-				# column value before, ignore it
-				if row in usedRows or col in usedCols:
-					continue
-
-				# if the distance between centroids is greater than
-				# the maximum distance, do not associate the two
-				# centroids to the same object
-				if D[row, col] > self.maxDistance:
-					continue
-
-				# otherwise, grab the object ID for the current row,
-				# set its new centroid, and reset the disappeared
-				# counter
-				objectID = objectIDs[row]
-				self.objects[objectID] = inputCentroids[col]
-				self.disappeared[objectID] = 0
-
-				# indicate that we have examined each of the row and
-				# column indexes, respectively
-				usedRows.add(row)
-				usedCols.add(col)
-
-			# compute both the row and column index we have NOT yet
-			# examined
-			unusedRows = set(range(0, D.shape[0])).difference(usedRows)
-			unusedCols = set(range(0, D.shape[1])).difference(usedCols)
-
-			# in the event that the number of object centroids is
-			# equal or greater than the number of input centroids
-			# we need to check and see if some of these objects have
-			# potentially disappeared
-			if D.shape[0] >= D.shape[1]:
-				# loop over the unused row indexes
-				for row in unusedRows:
-					# grab the object ID for the corresponding row
-					# index and increment the disappeared counter
-					objectID = objectIDs[row]
-					self.disappeared[objectID] += 1
-
-					# check to see if the number of consecutive
-					# frames the object has been marked "disappeared"
-					# for warrants deregistering the object
-					if self.disappeared[objectID] > self.maxDisappeared:
-						self.deregister(objectID)
-
-			# otherwise, if the number of input centroids is greater
-			# than the number of existing object centroids we need to
-			# register each new input centroid as a trackable object
-			else:
-				for col in unusedCols:
-					self.register(inputCentroids[col])
+		if len(self.ids) == 0:
+			self._register(inputCentroids)
+			return self.objects
+
+		# otherwise, we are currently tracking objects so we need to
+		# match the input centroids to existing object centroids
+		(rows, cols) = self._match(inputCentroids)
+
+		# set the new centroids of the matched objects and reset their
+		# disappeared counters
+		self.centroids[rows] = inputCentroids[cols]
+		self.missing[rows] = 0
+
+		# register the input centroids that were not matched to any
+		# object, then age the objects that were not matched
+		unusedRows = np.ones(len(self.ids), dtype="bool")
+		unusedRows[rows] = False
+		unusedCols = np.ones(len(inputCentroids), dtype="bool")
+		unusedCols[cols] = False
+		self._age(np.flatnonzero(unusedRows))
+		self._register(inputCentroids[unusedCols])
 
 		# return the set of trackable objects
-		return self.objects
\ No newline at end of file
+		return self.objects
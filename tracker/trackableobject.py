@@ -1,10 +1,41 @@
+# import the necessary packages
+from collections import deque
+
 class TrackableObject:
-	def __init__(self, objectID, centroid):
-		# store the object ID, then initialize a list of centroids
-		# using the current centroid
+	# fixed attributes keep each object small (no per-instance dict)
+	__slots__ = ("objectID", "centroids", "counted", "sumY", "count", "alpha", "meanY")
+
+	def __init__(self, objectID, centroid, history=32, alpha=None):
+		# store the object ID, then initialize a ring buffer holding the
+		# most recent centroids using the current centroid
 		self.objectID = objectID
-		self.centroids = [centroid]
+		self.centroids = deque([centroid], maxlen=history)
+
+		# running sum (or exponential moving average when alpha is
+		# set) of the y-coordinates, so the direction is computed in
+		# constant time however long the object has been tracked
+		self.sumY = centroid[1]
+		self.count = 1
+		self.alpha = alpha
+		self.meanY = centroid[1]
 
 		# initialize a boolean used to indicate if the object has
 		# already been counted or not
-		self.counted = False
\ No newline at end of file
+		self.counted = False
+
+	def update(self, centroid):
+		# the difference between the y-coordinate of the *current*
+		# centroid and the mean of *previous* centroids tells us in
+		# which direction the object is moving (negative for 'up' and
+		# positive for 'down')
+		direction = centroid[1] - self.meanY
+
+		# add the centroid to the history and update the mean
+		self.centroids.append(centroid)
+		if self.alpha is None:
+			self.sumY += centroid[1]
+			self.count += 1
+			self.meanY = self.sumY / self.count
+		else:
+			self.meanY += self.alpha * (centroid[1] - self.meanY)
+		return direction
@@ -0,0 +1,158 @@
+# import the necessary packages
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import dlib
+
+def start_trackers(rgb, boxes):
+	# construct a dlib rectangle object from each bounding box and
+	# start a dlib correlation tracker on it
+	trackers = []
+	for (startX, startY, endX, endY) in boxes:
+		tracker = dlib.correlation_tracker()
+		rect = dlib.rectangle(startX, startY, endX, endY)
+		tracker.start_track(rgb, rect)
+		trackers.append(tracker)
+	return trackers
+
+def update_trackers(trackers, rgb):
+	# update each tracker, grab its confidence (peak-to-sidelobe ratio)
+	# and unpack its updated position
+	rects = []
+	confidences = []
+	for tracker in trackers:
+		confidences.append(tracker.update(rgb))
+		pos = tracker.get_position()
+		rects.append((int(pos.left()), int(pos.top()),
+			int(pos.right()), int(pos.bottom())))
+	return (rects, confidences)
+
+def _shard(conn):
+	# worker process owning one shard of the trackers, the frames are
+	# read from shared memory and only the boxes go through the pipe
+	# (the blocks stay mapped, frames come from a few reused buffers)
+	trackers = []
+	blocks = {}
+	while True:
+		(cmd, name, shape, boxes) = conn.recv()
+		if cmd == "stop":
+			break
+		if name not in blocks:
+			blocks[name] = shared_memory.SharedMemory(name=name)
+		rgb = np.ndarray(shape, dtype="uint8", buffer=blocks[name].buf)
+		if cmd == "start":
+			trackers = start_trackers(rgb, boxes)
+			conn.send(None)
+		else:
+			conn.send(update_trackers(trackers, rgb))
+		# drop the view, the block can't be closed while it is exported
+		del rgb
+	for shm in blocks.values():
+		shm.close()
+	conn.close()
+
+class TrackerPool:
+	""" Runs the dlib correlation trackers of a stream in parallel. """
+
+	def __init__(self, workers=1, mode="process", frames=None):
+		# split the trackers between this many processes or threads
+		# (1 = update them serially in the calling thread); dlib holds
+		# the GIL while it updates, so only processes scale with cores
+		self.workers = max(1, workers)
+		# frames from a shared FramePool are passed to the worker
+		# processes by name, without copying them
+		self.frames = frames
+		self.mode = mode
+		self.count = 0
+		self.chunks = []
+		self.executor = None
+		self.procs = []
+		self.shm = None
+
+		# daemonic processes can't start processes of their own, use
+		# threads there (the counter's own pools are not daemonic)
+		if mode == "process" and multiprocessing.current_process().daemon:
+			self.mode = "thread"
+
+		if self.workers > 1 and self.mode == "thread":
+			self.executor = ThreadPoolExecutor(self.workers)
+		elif self.workers > 1 and self.mode == "process":
+			# start the shared memory bookkeeping before forking, so the
+			# shards share it with us instead of each starting their own
+			resource_tracker.ensure_running()
+			for _ in range(self.workers):
+				(parent, child) = multiprocessing.Pipe()
+				proc = multiprocessing.Process(target=_shard, args=(child,), daemon=True)
+				proc.start()
+				self.procs.append((proc, parent))
+
+	def __len__(self):
+		return self.count
+
+	@property
+	def shared(self):
+		# whether the trackers read their frames from shared memory
+		return bool(self.procs)
+
+	def _share(self, rgb):
+		# frames already in shared memory are passed as they are,
+		# otherwise copy the frame into the block read by the shards
+		name = self.frames.name(rgb) if self.frames is not None else None
+		if name is not None:
+			return (name, rgb.shape)
+		if self.shm is None or self.shm.size < rgb.nbytes:
+			if self.shm is not None:
+				self.shm.close()
+				self.shm.unlink()
+			self.shm = shared_memory.SharedMemory(create=True, size=rgb.nbytes)
+		np.ndarray(rgb.shape, dtype="uint8", buffer=self.shm.buf)[:] = rgb
+		return (self.shm.name, rgb.shape)
+
+	def start(self, rgb, boxes):
+		# replace the current trackers with new ones on the given boxes
+		self.count = len(boxes)
+		if self.procs:
+			(name, shape) = self._share(rgb)
+			for (i, (_, conn)) in enumerate(self.procs):
+				conn.send(("start", name, shape, boxes[i::len(self.procs)]))
+			for (_, conn) in self.procs:
+				conn.recv()
+		elif self.executor is not None:
+			shards = [boxes[i::self.workers] for i in range(self.workers)]
+			self.chunks = list(self.executor.map(start_trackers, [rgb] * self.workers, shards))
+		else:
+			self.chunks = [start_trackers(rgb, boxes)]
+
+	def update(self, rgb):
+		# update every tracker on the new frame and return their boxes
+		# along with their confidences
+		if self.procs:
+			(name, shape) = self._share(rgb)
+			for (_, conn) in self.procs:
+				conn.send(("update", name, shape, None))
+			results = [conn.recv() for (_, conn) in self.procs]
+		elif self.executor is not None:
+			results = list(self.executor.map(update_trackers, self.chunks, [rgb] * len(self.chunks)))
+		else:
+			results = [update_trackers(chunk, rgb) for chunk in self.chunks]
+
+		rects = []
+		confidences = []
+		for (r, c) in results:
+			rects.extend(r)
+			confidences.extend(c)
+		return (rects, confidences)
+
+	def close(self):
+		if self.executor is not None:
+			self.executor.shutdown()
+		for (proc, conn) in self.procs:
+			conn.send(("stop", None, None, None))
+			proc.join()
+		self.procs = []
+		if self.shm is not None:
+			self.shm.close()
+			self.shm.unlink()
+			self.shm = None
@@ -0,0 +1,148 @@
+# import the necessary packages
+import numpy as np
+
+# pixels on either side of a line a track has to get past before it
+# counts as being on that side, so jitter on the line isn't counted
+MARGIN = 10
+
+def cross(u, v):
+	# z component of the cross product of (broadcast) 2D vectors
+	return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+class Zones:
+	""" Line crossings and polygon occupancy of all the tracked objects at once. """
+
+	def __init__(self, zones):
+		# zones come from the config as {"name": .., "line": [[x, y], [x, y]]}
+		# or {"name": .., "polygon": [[x, y], ..]}, in fractions of the
+		# frame width/height so they don't depend on the frame size;
+		# crossing a line towards its right-hand side (seen from the
+		# first point, y pointing down) is "in", the other way is "out",
+		# once the track is more than "margin" pixels (default MARGIN)
+		# past the line
+		self.lines = [z for z in zones if "line" in z]
+		self.polygons = [z for z in zones if "polygon" in z]
+		self.names = [z["name"] for z in self.lines + self.polygons]
+		self.line_names = {z["name"] for z in self.lines}
+		if len(set(self.names)) != len(self.names):
+			raise ValueError("zone names must be unique")
+		for z in self.polygons:
+			if len(z["polygon"]) < 3:
+				raise ValueError("zone '{}' needs at least 3 points".format(z["name"]))
+
+		# per-zone counters: lines count their crossings (occupancy is
+		# in - out), polygons the tracks entering/leaving and inside
+		self.counts = {name: {"in": 0, "out": 0, "occupancy": 0} for name in self.names}
+
+		# the object IDs (sorted) seen in the last update, the side of
+		# each line they were last seen clear of (+1 right, -1 left, 0 not
+		# yet) and where, and whether they were inside each polygon
+		self.ids = np.empty(0, dtype="int")
+		self.clear_sides = np.empty((0, len(self.lines)), dtype="int")
+		self.clear_points = np.empty((0, len(self.lines), 2), dtype="float")
+		self.inside = np.empty((0, len(self.polygons)), dtype="bool")
+		self.size = None
+
+	def __len__(self):
+		return len(self.names)
+
+	def scale(self, W, H):
+		# the zones in pixels of a W x H frame, as flat arrays: the line
+		# segments A -> B, and the edges of every polygon one after the
+		# other (starts[i] is the first edge of polygon i)
+		self.size = (W, H)
+		scale = np.array([W, H], dtype="float")
+		lines = np.array([z["line"] for z in self.lines], dtype="float").reshape(-1, 2, 2) * scale
+		(self.A, self.B) = (lines[:, 0], lines[:, 1])
+		self.margins = np.array([z.get("margin", MARGIN) for z in self.lines], dtype="float")
+		points = [np.array(z["polygon"], dtype="float") * scale for z in self.polygons]
+		self.starts = np.cumsum([0] + [len(p) for p in points[:-1]]).astype("int")
+		if points:
+			self.E1 = np.concatenate(points)
+			self.E2 = np.concatenate([np.roll(p, -1, axis=0) for p in points])
+		else:
+			self.E1 = self.E2 = np.empty((0, 2))
+
+	def contains(self, points):
+		# (N, P) bool: point n inside polygon p, by ray casting against
+		# all the edges at once and counting the crossings per polygon
+		if not len(self.polygons) or not len(points):
+			return np.zeros((len(points), len(self.polygons)), dtype="bool")
+		(px, py) = (points[:, :1], points[:, 1:])
+		(x1, y1) = (self.E1[:, 0], self.E1[:, 1])
+		(x2, y2) = (self.E2[:, 0], self.E2[:, 1])
+		spans = (y1 > py) != (y2 > py)
+		with np.errstate(divide="ignore", invalid="ignore"):
+			x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+		hits = spans & (px < x)
+		return np.add.reduceat(hits, self.starts, axis=1, dtype="int") % 2 == 1
+
+	def sides(self, points):
+		# (N, L) int: +1 where point n is more than the margin to the
+		# right-hand side of line l, -1 to its left, 0 within the margin
+		AB = self.B - self.A
+		length = np.maximum(np.hypot(AB[:, 0], AB[:, 1]), 1e-9)
+		distance = cross(AB[None], points[:, None] - self.A[None]) / length
+		return np.where(distance > self.margins, 1, np.where(distance < -self.margins, -1, 0))
+
+	def straddles(self, P, Q):
+		# (N, L) bool: the step P[n, l] -> Q[n] passes between the ends
+		# of line l (and not beside it)
+		PQ = Q[:, None] - P
+		return cross(PQ, self.A[None] - P) * cross(PQ, self.B[None] - P) <= 0
+
+	def update(self, ids, centroids, W, H):
+		# compare the tracked objects (sorted IDs and centroids of the
+		# centroid tracker) with their last positions and return this
+		# update's events as [(zone name, "in"/"out", object ID)]
+		if self.size != (W, H):
+			self.scale(W, H)
+		centroids = np.asarray(centroids, dtype="float").reshape(-1, 2)
+
+		# the rows of the objects seen in the last update
+		ids = np.asarray(ids, dtype="int")
+		if len(self.ids):
+			rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+			seen = self.ids[rows] == ids
+		else:
+			rows = np.zeros(len(ids), dtype="int")
+			seen = np.zeros(len(ids), dtype="bool")
+
+		# lines: a track crosses when it gets clear of the line on the
+		# other side than it last was, on a path between the line's ends
+		# (jitter within the margin keeps its last side)
+		events = []
+		side = self.sides(centroids)
+		last = np.zeros_like(side)
+		last[seen] = self.clear_sides[rows[seen]]
+		anchors = np.repeat(centroids[:, None], len(self.lines), axis=1)
+		anchors[seen] = self.clear_points[rows[seen]]
+		crossed = (side != 0) & (last != 0) & (side != last) & self.straddles(anchors, centroids)
+		for (n, l) in zip(*np.nonzero(crossed)):
+			direction = "in" if side[n, l] > 0 else "out"
+			name = self.lines[l]["name"]
+			self.counts[name][direction] += 1
+			events.append((name, direction, int(ids[n])))
+		for z in self.lines:
+			counts = self.counts[z["name"]]
+			counts["occupancy"] = counts["in"] - counts["out"]
+
+		# polygons: entering/leaving, and the objects inside right now
+		# (a new object starts where it is first seen, without an event)
+		inside = self.contains(centroids)
+		before = inside.copy()
+		before[seen] = self.inside[rows[seen]]
+		for (n, p) in zip(*np.nonzero(inside != before)):
+			direction = "in" if inside[n, p] else "out"
+			name = self.polygons[p]["name"]
+			self.counts[name][direction] += 1
+			events.append((name, direction, int(ids[n])))
+		for (p, z) in enumerate(self.polygons):
+			self.counts[z["name"]]["occupancy"] = int(inside[:, p].sum())
+
+		clear = side != 0
+		self.ids = ids
+		self.clear_sides = np.where(clear, side, last)
+		self.clear_points = np.where(clear[..., None], centroids[:, None], anchors)
+		self.inside = inside
+		return events
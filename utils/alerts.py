@@ -0,0 +1,165 @@
+from utils.mailer import Mailer
+import urllib.request
+import threading
+import logging
+import queue
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+class Alert:
+    """ One alert, plus how many more with the same key it stands for. """
+
+    def __init__(self, key, subject, text, **fields):
+        # alerts with the same key (e.g. the threshold of one camera) are
+        # rate limited and coalesced together
+        self.key = key
+        self.subject = subject
+        self.text = text
+        self.fields = fields
+        self.time = time.time()
+        self.count = 1
+
+    def body(self):
+        if self.count == 1:
+            return self.text
+        return "{}\n\n({} alerts since the previous one was sent, this is the latest)".format(
+            self.text, self.count)
+
+    def to_dict(self):
+        return dict(self.fields, key = self.key, subject = self.subject, text = self.body(),
+            time = self.time, count = self.count)
+
+class EmailSink:
+    """ Mails the alerts over one reused SMTP connection. """
+
+    def __init__(self, recipients, mailer = None):
+        self.recipients = recipients
+        self.mailer = mailer or Mailer()
+
+    def emit(self, alert):
+        self.mailer.send(self.recipients, alert.subject, alert.body())
+
+    def close(self):
+        self.mailer.close()
+
+class WebhookSink:
+    """ POSTs the alerts as JSON to a URL (Slack/Teams style hooks, ntfy, ..). """
+
+    def __init__(self, url, timeout = 10):
+        self.url = url
+        self.timeout = timeout
+
+    def emit(self, alert):
+        request = urllib.request.Request(self.url, data = json.dumps(alert.to_dict()).encode(),
+            headers = {"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout = self.timeout):
+            pass
+
+    def close(self):
+        pass
+
+class FileSink:
+    """ Appends the alerts to a local file, one JSON object per line. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, alert):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(alert.to_dict()) + "\n")
+
+    def close(self):
+        pass
+
+class AlertDispatcher:
+    """ Sends alerts to the sinks from a single background thread. """
+
+    def __init__(self, sinks, interval = 60.0, maxsize = 100):
+        self.sinks = sinks
+        # an alert is sent at most once every interval seconds per key, the
+        # ones raised in between are coalesced into the next one
+        self.interval = interval
+        self.q = queue.Queue(maxsize)
+        # key -> time last sent / the coalesced alert waiting for its turn
+        self.last = {}
+        self.pending = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target = self._worker, daemon = True)
+        self.thread.start()
+
+    def send(self, key, subject, text, **fields):
+        # queue an alert, never blocks the video loop
+        try:
+            self.q.put_nowait(Alert(key, subject, text, **fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # send the coalesced alerts still waiting and stop the worker
+        self.q.put(None)
+        self.thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self):
+        return {"sent": self.sent, "coalesced": self.coalesced, "dropped": self.dropped,
+            "failed": self.failed}
+
+    def _worker(self):
+        running = True
+        while running:
+            # sleep until the next coalesced alert is due or a new one comes in
+            due = [self.last.get(key, 0) + self.interval for key in self.pending]
+            timeout = max(0, min(due) - time.time()) if due else None
+            try:
+                alert = self.q.get(timeout = timeout)
+                if alert is None:
+                    running = False
+                else:
+                    self._add(alert)
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            for key in list(self.pending):
+                if not running or now >= self.last.get(key, 0) + self.interval:
+                    self._dispatch(self.pending.pop(key))
+
+    def _add(self, alert):
+        # a repeat of an alert still waiting replaces it (the newest text
+        # wins) and adds to its count
+        previous = self.pending.get(alert.key)
+        if previous is not None:
+            alert.count += previous.count
+            self.coalesced += 1
+        self.pending[alert.key] = alert
+
+    def _dispatch(self, alert):
+        self.last[alert.key] = time.time()
+        for sink in self.sinks:
+            try:
+                sink.emit(alert)
+            except Exception as e:
+                self.failed += 1
+                logger.error("Failed to send the alert via {}: {}".format(type(sink).__name__, e))
+        self.sent += 1
+        logger.info("Alert sent!")
+
+def from_config(config):
+    # the sinks turned on in utils/config.json, None when there are none
+    sinks = []
+    if config.get("Email_Send") and config.get("Email_Receive"):
+        sinks.append(EmailSink(config["Email_Receive"]))
+    if config.get("Alert_Webhook"):
+        sinks.append(WebhookSink(config["Alert_Webhook"]))
+    if config.get("Alert_File"):
+        sinks.append(FileSink(config["Alert_File"]))
+    if not sinks:
+        logger.warning("Alerts are on but no sink is configured (email, webhook or file)")
+        return None
+    return AlertDispatcher(sinks, config.get("Alert_Interval", 60))
@@ -0,0 +1,68 @@
+from multiprocessing import shared_memory
+import threading
+import numpy as np
+
+class FramePool:
+    """ Reusable frame buffers, handed out and given back by shape. """
+
+    def __init__(self, shared = False):
+        # shared buffers live in shared memory, so worker processes can
+        # map a frame by name instead of receiving a copy
+        self.shared = shared
+        self.free = {}
+        self.blocks = {}
+        self.lock = threading.Lock()
+        # buffers allocated vs handed out again
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, shape, dtype = "uint8"):
+        # a spare buffer of this shape, or a new one when all of them are
+        # in use -- the pool only grows to the number of frames in flight
+        dtype = np.dtype(dtype)
+        key = (tuple(shape), dtype.str)
+        with self.lock:
+            free = self.free.get(key)
+            if free:
+                self.reused += 1
+                return free.pop()
+            self.allocated += 1
+        if not self.shared:
+            return np.empty(shape, dtype)
+
+        shm = shared_memory.SharedMemory(create = True,
+            size = max(1, int(np.prod(shape)) * dtype.itemsize))
+        buf = np.ndarray(shape, dtype, buffer = shm.buf)
+        with self.lock:
+            self.blocks[buf.ctypes.data] = shm
+        return buf
+
+    def release(self, *buffers):
+        # give buffers back once nothing reads them anymore (None is
+        # ignored)
+        with self.lock:
+            for buf in buffers:
+                if buf is not None:
+                    self.free.setdefault((buf.shape, buf.dtype.str), []).append(buf)
+
+    def name(self, buf):
+        # the shared memory block behind a buffer of this pool, if any
+        shm = self.blocks.get(buf.ctypes.data)
+        return shm.name if shm is not None else None
+
+    def stats(self):
+        return {"allocated": self.allocated, "reused": self.reused}
+
+    def close(self):
+        with self.lock:
+            self.free = {}
+            blocks = list(self.blocks.values())
+            self.blocks = {}
+        for shm in blocks:
+            # frames still referenced elsewhere keep their mapping until
+            # they are gone, the block itself is removed either way
+            try:
+                shm.close()
+            except BufferError:
+                pass
+            shm.unlink()
@@ -0,0 +1,111 @@
+import datetime
+import struct
+import gzip
+import time
+import csv
+import os
+
+HEADER = ("Time", "Direction", "Track ID", "Entries", "Exits", "Camera")
+
+# fixed-size little-endian record of the binary format:
+# timestamp (float64), direction (+1 in / -1 out), track id, entries,
+# exits and camera (uint32 each) -- 29 bytes per crossing
+RECORD = struct.Struct("<dbIIII")
+DIRECTIONS = {"in": 1, "out": -1}
+
+class EventLog:
+    """ Append-only log of crossings, rotated by day and size. """
+
+    def __init__(self, directory = "utils/data/logs", name = "counting_data",
+        fmt = "csv", max_size = 0, interval = 5.0):
+        if fmt not in ("csv", "gz", "bin"):
+            raise ValueError("unknown log format: {}".format(fmt))
+        self.directory = directory
+        self.name = name
+        self.fmt = fmt
+        # rotate to a new segment once the current one reaches max_size
+        # bytes (0 = daily files only)
+        self.max_size = max_size
+        # rows are buffered and flushed every interval seconds
+        self.interval = interval
+        self.file = None
+        self.writer = None
+        self.day = None
+        self.segment = 0
+        self.last_flush = time.time()
+
+    def path(self, day, segment):
+        ext = {"csv": "csv", "gz": "csv.gz", "bin": "bin"}[self.fmt]
+        suffix = ".{}".format(segment) if segment else ""
+        return os.path.join(self.directory, "{}_{}{}.{}".format(self.name, day, suffix, ext))
+
+    def _open(self, day):
+        # pick up the last segment of the day after a restart
+        self.close()
+        self.day = day
+        self.segment = 0
+        while os.path.exists(self.path(day, self.segment + 1)):
+            self.segment += 1
+        self._open_segment()
+
+    def _open_segment(self):
+        path = self.path(self.day, self.segment)
+        new = not os.path.exists(path)
+        os.makedirs(self.directory, exist_ok = True)
+        if self.fmt == "bin":
+            self.file = open(path, "ab")
+        elif self.fmt == "gz":
+            # a restart appends a new gzip member, readers see one stream
+            self.file = gzip.open(path, "at", newline = "")
+        else:
+            self.file = open(path, "a", newline = "")
+        if self.fmt != "bin":
+            self.writer = csv.writer(self.file, quoting = csv.QUOTE_ALL)
+            if new:
+                self.writer.writerow(HEADER)
+
+    def _size(self):
+        return os.path.getsize(self.path(self.day, self.segment))
+
+    def add(self, direction, track_id, entries, exits, camera = 0, timestamp = None):
+        # append a single crossing, the cost does not depend on how many
+        # crossings were logged before
+        timestamp = time.time() if timestamp is None else timestamp
+        day = datetime.date.fromtimestamp(timestamp).isoformat()
+        if day != self.day:
+            self._open(day)
+        elif self.max_size and self._size() >= self.max_size:
+            self.close()
+            self.segment += 1
+            self._open_segment()
+
+        if self.fmt == "bin":
+            self.file.write(RECORD.pack(timestamp, DIRECTIONS[direction], track_id,
+                entries, exits, camera))
+        else:
+            date_time = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            self.writer.writerow((date_time, direction, track_id, entries, exits, camera))
+        self.poll()
+
+    def poll(self):
+        # cheap enough to call every frame, flushes on the interval
+        if self.file is not None and time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.writer = None
+
+def read_binary(path):
+    # read a binary segment back as a list of tuples
+    with open(path, "rb") as f:
+        data = f.read()
+    size = len(data) - len(data) % RECORD.size
+    return [RECORD.unpack_from(data, i) for i in range(0, size, RECORD.size)]
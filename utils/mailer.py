@@ -1,5 +1,10 @@
+from email.message import EmailMessage
 import smtplib
+import logging
 import json
+import time
+
+logger = logging.getLogger(__name__)
 
 # initiate features config.
 with open("utils/config.json", "r") as file:
@@ -8,19 +13,56 @@ with open("utils/config.json", "r") as file:
 class Mailer:
     """ Class to initiate the email alert function. """
 
-    def __init__(self):
-        self.email = config["Email_Send"]
-        self.password = config["Email_Password"]
-        self.port = 465
-        self.server = smtplib.SMTP_SSL('smtp.gmail.com', self.port)
+    def __init__(self, host = None, port = None, ssl = None, email = None, password = None,
+        timeout = 10, idle = 60):
+        # Gmail over SSL unless the config (or the caller, e.g. a local
+        # SMTP stand-in) says otherwise
+        self.host = host or config.get("SMTP_Host", "smtp.gmail.com")
+        self.port = port or config.get("SMTP_Port", 465)
+        self.ssl = config.get("SMTP_SSL", True) if ssl is None else ssl
+        self.email = config["Email_Send"] if email is None else email
+        self.password = config["Email_Password"] if password is None else password
+        self.timeout = timeout
+        # the connection is opened on the first send and kept for the next
+        # ones, unless it sat unused for idle seconds (servers drop those)
+        self.idle = idle
+        self.server = None
+        self.last = 0.0
+
+    def connect(self):
+        smtp = smtplib.SMTP_SSL if self.ssl else smtplib.SMTP
+        self.server = smtp(self.host, self.port, timeout = self.timeout)
+        if self.password:
+            self.server.login(self.email, self.password)
 
-    def send(self, mail):
-        self.server = smtplib.SMTP_SSL('smtp.gmail.com', self.port)
-        self.server.login(self.email, self.password)
+    def send(self, mail, subject = "ALERT!", text = "People limit exceeded in your building!"):
         # message to be sent
-        SUBJECT = 'ALERT!'
-        TEXT = f'People limit exceeded in your building!'
-        message = 'Subject: {}\n\n{}'.format(SUBJECT, TEXT)
-        # send the mail
-        self.server.sendmail(self.email, mail, message)
-        self.server.quit()
+        message = EmailMessage()
+        message["Subject"] = subject
+        message["From"] = self.email
+        message["To"] = mail
+        message.set_content(text)
+
+        if self.server is not None and time.time() - self.last > self.idle:
+            self.close()
+        # send the mail, reconnecting once if the server hung up on us
+        for attempt in range(2):
+            try:
+                if self.server is None:
+                    self.connect()
+                self.server.send_message(message)
+                break
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                self.server = None
+                if attempt:
+                    raise
+                logger.info("SMTP connection lost, reconnecting..")
+        self.last = time.time()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
@@ -0,0 +1,192 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import logging
+import bisect
+import errno
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# prefix of every exported metric
+PREFIX = "people_counter"
+
+class Histogram:
+    """ Latency histogram with fixed buckets, Prometheus style. """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        # the last bucket counts everything above the largest bound
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """ Per-stage latencies of the hot path, plus gauges read on export. """
+
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (stage, camera) -> Histogram
+        self.histograms = {}
+        # callables returning [(name, labels, value)], polled on export
+        # so queue depths, drops and tracks cost nothing per frame
+        self.collectors = []
+
+    def time(self):
+        return time.perf_counter()
+
+    def observe(self, stage, start, camera = None):
+        # record the time since start (from time()) for a stage
+        elapsed = time.perf_counter() - start
+        key = (stage, camera)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(elapsed)
+
+    def collect(self, func):
+        with self.lock:
+            self.collectors.append(func)
+
+    def discard(self, func):
+        with self.lock:
+            if func in self.collectors:
+                self.collectors.remove(func)
+
+    def _gauges(self):
+        with self.lock:
+            collectors = list(self.collectors)
+        gauges = []
+        for func in collectors:
+            try:
+                gauges.extend(func())
+            except Exception:
+                logger.exception("Metrics collector failed")
+        return gauges
+
+    def snapshot(self):
+        # everything as plain data, for the JSON dump
+        with self.lock:
+            histograms = [(stage, camera, h.count, h.sum, list(h.counts))
+                for ((stage, camera), h) in self.histograms.items()]
+        return {
+            "time": time.time(),
+            "pid": os.getpid(),
+            "buckets": list(BUCKETS),
+            "stages": [{"stage": stage, "camera": camera, "count": count,
+                "mean_ms": 1000 * total / count if count else None, "buckets": counts}
+                for (stage, camera, count, total, counts) in histograms],
+            "gauges": [{"name": name, "labels": labels, "value": value}
+                for (name, labels, value) in self._gauges()],
+        }
+
+    def render(self):
+        # the Prometheus text exposition format
+        lines = ["# TYPE {}_stage_seconds histogram".format(PREFIX)]
+        with self.lock:
+            histograms = [(stage, camera, h.count, h.sum, list(h.counts))
+                for ((stage, camera), h) in self.histograms.items()]
+        for (stage, camera, count, total, counts) in sorted(histograms, key = str):
+            labels = 'stage="{}"'.format(stage)
+            if camera is not None:
+                labels += ',camera="{}"'.format(camera)
+            cumulative = 0
+            for (bound, n) in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += n
+                lines.append('{}_stage_seconds_bucket{{{},le="{}"}} {}'.format(
+                    PREFIX, labels, bound, cumulative))
+            lines.append("{}_stage_seconds_sum{{{}}} {}".format(PREFIX, labels, total))
+            lines.append("{}_stage_seconds_count{{{}}} {}".format(PREFIX, labels, count))
+
+        # the samples of a metric have to be listed together
+        seen = set()
+        for (name, labels, value) in sorted(self._gauges(), key = lambda g: g[0]):
+            if name not in seen:
+                lines.append("# TYPE {}_{} gauge".format(PREFIX, name))
+                seen.add(name)
+            text = ",".join('{}="{}"'.format(k, v) for (k, v) in sorted(labels.items()))
+            lines.append("{}_{}{{{}}} {}".format(PREFIX, name, text, value))
+        return "\n".join(lines) + "\n"
+
+class NullMetrics:
+    """ Stand-in when metrics are off, every call returns right away. """
+
+    enabled = False
+
+    def time(self):
+        return 0.0
+
+    def observe(self, stage, start, camera = None):
+        pass
+
+    def collect(self, func):
+        pass
+
+    def discard(self, func):
+        pass
+
+# the shared off switch
+NULL = NullMetrics()
+
+def serve(metrics, port, host = "127.0.0.1", tries = 16):
+    # serve /metrics on the first free port from port on (worker
+    # processes of the multi-camera mode each get their own), returns
+    # the port or None
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] == "/metrics.json":
+                body = json.dumps(metrics.snapshot()).encode()
+                kind = "application/json"
+            elif self.path.split("?")[0] in ("/", "/metrics"):
+                body = metrics.render().encode()
+                kind = "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", kind)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    for p in range(port, port + tries):
+        try:
+            server = ThreadingHTTPServer((host, p), Handler)
+        except OSError as e:
+            if e.errno == errno.EADDRINUSE:
+                continue
+            raise
+        server.daemon_threads = True
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        logger.info("Serving metrics on http://{}:{}/metrics".format(host, p))
+        return p
+    logger.error("No free port for the metrics in {}-{}".format(port, port + tries - 1))
+    return None
+
+def dump(metrics, path, interval = 10.0):
+    # write a JSON snapshot to path every interval seconds (replaced
+    # atomically, so readers never see half a file)
+    def run():
+        while True:
+            time.sleep(interval)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(metrics.snapshot(), f)
+            os.replace(tmp, path)
+    threading.Thread(target = run, daemon = True).start()
@@ -0,0 +1,191 @@
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# what a stage does when the queue in front of it is full
+BLOCK = "block"         # wait for the stage to catch up (back-pressure)
+DROP_NEW = "drop_new"   # discard the incoming frame
+DROP_OLD = "drop_old"   # discard the oldest queued frame to keep the latest
+POLICIES = (BLOCK, DROP_NEW, DROP_OLD)
+
+# end of stream marker, passed down the pipeline and never dropped
+STOP = object()
+
+class Packet:
+    """ A frame travelling through the pipeline along with its stage results. """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.captured = time.time()
+
+class Stage:
+    """ One pipeline step fed by a bounded queue with a drop policy. """
+
+    def __init__(self, name, func, maxsize = 4, policy = BLOCK, main = False):
+        if policy not in POLICIES:
+            raise ValueError("unknown drop policy: {}".format(policy))
+        self.name = name
+        self.func = func
+        self.policy = policy
+        # the main stage runs in the calling thread (e.g. for cv2.imshow)
+        self.main = main
+        self.queue = queue.Queue(maxsize)
+        self.next = None
+        # per-stage stats
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.latency = 0.0
+        self.max_depth = 0
+        # called when the stage fails, so the pipeline can wind down
+        self.on_error = None
+        self.failed = False
+        # called with every packet dropped on the way, e.g. to recycle
+        # its frame buffers
+        self.on_drop = None
+
+    def put(self, item):
+        # the end of stream marker always waits for room
+        if item is STOP or self.policy == BLOCK:
+            self.queue.put(item)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    if self.policy == DROP_NEW:
+                        self.drop(item)
+                        return
+                    try:
+                        self.drop(self.queue.get_nowait())
+                    except queue.Empty:
+                        pass
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def drop(self, packet):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(packet)
+
+    def forward(self, item):
+        if self.next is not None:
+            self.next.put(item)
+
+    def run(self):
+        while True:
+            packet = self.queue.get()
+            if packet is STOP:
+                self.forward(STOP)
+                return
+            # after a failure keep draining the queue, so the stages in
+            # front of this one never block, until the stop marker arrives
+            if self.failed:
+                self.drop(packet)
+                continue
+            start = time.perf_counter()
+            try:
+                result = self.func(packet)
+            except Exception:
+                logger.exception("Pipeline stage '{}' failed".format(self.name))
+                self.failed = True
+                self.drop(packet)
+                if self.on_error is not None:
+                    self.on_error()
+                continue
+            self.busy += time.perf_counter() - start
+            self.processed += 1
+            # time since the frame was captured, i.e. end-to-end latency
+            # once the packet reaches the last stage
+            self.latency += time.time() - packet.captured
+            # a stage can consume a packet by returning None
+            if result is not None:
+                self.forward(result)
+
+class Pipeline:
+    """ Runs a frame source and a chain of stages, each in its own thread. """
+
+    def __init__(self, read, stages, release = None):
+        # the capture stage pulls frames from read() until it returns None,
+        # the queue (and drop policy) of the first stage sits behind it;
+        # release() gets the packets dropped on the way
+        self.read = read
+        self.capture = Stage("capture", None)
+        self.stages = stages
+        self.stopped = threading.Event()
+
+        # chain the queues together
+        chain = [self.capture] + stages
+        for (stage, nxt) in zip(chain, chain[1:]):
+            stage.next = nxt
+        for stage in stages:
+            stage.on_error = self.stop
+            stage.on_drop = release
+        self.started = None
+
+    def _capture(self):
+        while not self.stopped.is_set():
+            start = time.perf_counter()
+            frame = self.read()
+            if frame is None:
+                break
+            self.capture.busy += time.perf_counter() - start
+            self.capture.processed += 1
+            self.capture.forward(Packet(frame))
+        self.capture.forward(STOP)
+
+    def stop(self):
+        # ask the capture stage to end the stream, the frames already in
+        # flight are drained through the remaining stages
+        self.stopped.set()
+
+    def run(self):
+        self.started = time.time()
+        threads = [threading.Thread(target = self._capture, daemon = True)]
+        threads += [threading.Thread(target = stage.run, daemon = True)
+            for stage in self.stages if not stage.main]
+        for t in threads:
+            t.start()
+
+        # run the main stage (if any) in this thread, then wait for the
+        # stop marker to reach the end of the chain
+        for stage in self.stages:
+            if stage.main:
+                stage.run()
+        for t in threads:
+            t.join()
+
+    def stats(self):
+        # frames, FPS, busy time, latency and drops of every stage
+        elapsed = max(time.time() - (self.started or time.time()), 1e-6)
+        stats = []
+        for stage in [self.capture] + self.stages:
+            processed = max(stage.processed, 1)
+            stats.append({
+                "stage": stage.name,
+                "frames": stage.processed,
+                "fps": stage.processed / elapsed,
+                "busy_ms": 1000 * stage.busy / processed,
+                "latency_ms": 1000 * stage.latency / processed,
+                "dropped": stage.dropped,
+                "max_queue": stage.max_depth,
+            })
+        return stats
+
+    def gauges(self):
+        # queue depths and drops, polled by the metrics export
+        gauges = []
+        for stage in [self.capture] + self.stages:
+            labels = {"stage": stage.name}
+            gauges += [("queue_depth", labels, stage.queue.qsize()),
+                ("dropped_frames", labels, stage.dropped),
+                ("stage_frames", labels, stage.processed)]
+        return gauges
+
+    def report(self):
+        for s in self.stats():
+            logger.info("{stage}: {frames} frames, {fps:.2f} FPS, {busy_ms:.1f} ms/frame, "
+                "latency {latency_ms:.1f} ms, dropped {dropped}, max queue {max_queue}".format(**s))
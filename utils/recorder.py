@@ -0,0 +1,142 @@
+import numpy as np
+import threading
+import datetime
+import logging
+import queue
+import cv2
+import os
+
+logger = logging.getLogger(__name__)
+
+class ClipRecorder:
+    """ Keeps the last seconds of frames in memory and writes clips around events. """
+
+    def __init__(self, folder, prefix = "clip", fps = 30.0, pre_roll = 5.0, post_roll = 5.0,
+        backlog = 2.0, block = False, fourcc = "mp4v"):
+        self.folder = folder
+        self.prefix = prefix
+        self.fps = fps
+        self.fourcc = fourcc
+        # frames kept before the event and recorded after the last one
+        self.pre_roll = max(1, int(round(pre_roll * fps)))
+        self.post_roll = max(1, int(round(post_roll * fps)))
+        # frames a clip may run ahead of the encoder before they are dropped
+        self.backlog = max(1, int(round(backlog * fps)))
+        # wait for the encoder instead (video files, where no frame is live)
+        self.block = block
+
+        # the pre-roll ring, preallocated on the first frame; while a clip
+        # starts it belongs to the encoder, which hands it back once the
+        # pre-roll is written
+        self.ring = None
+        self.rings = 0
+        self.spare = queue.Queue()
+        self.head = 0
+        self.count = 0
+        # buffers the frames of a running clip are copied into
+        self.free = queue.Queue()
+        self.allocated = 0
+        # frames still to record after the last event, None when idle
+        self.remaining = None
+
+        self.clips = 0
+        self.dropped = 0
+        os.makedirs(folder, exist_ok = True)
+        self.q = queue.Queue()
+        self.thread = threading.Thread(target = self._encoder, daemon = True)
+        self.thread.start()
+
+    def trigger(self, reason = "event"):
+        # start a clip with the pre-roll, or keep the running one going
+        # for another post_roll frames
+        if self.remaining is None:
+            self.clips += 1
+            name = "{}_{}_{}_{}.mp4".format(self.prefix,
+                datetime.datetime.now().strftime("%Y%m%d-%H%M%S"), self.clips, reason)
+            self.q.put(("start", (os.path.join(self.folder, name), self.ring, self.head, self.count)))
+            self.ring = None
+            self.head = 0
+            self.count = 0
+        self.remaining = self.post_roll
+
+    def add(self, frame):
+        # the frame goes to the running clip or into the pre-roll ring,
+        # a copy either way since the caller reuses its buffers
+        if self.remaining is not None:
+            buffer = self._buffer(frame)
+            if buffer is None:
+                self.dropped += 1
+            else:
+                np.copyto(buffer, frame)
+                self.q.put(("frame", buffer))
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.q.put(("end", None))
+                self.remaining = None
+            return
+
+        if self.ring is None:
+            try:
+                self.ring = self.spare.get(self.block and self.rings > 0)
+            except queue.Empty:
+                # the encoder still writes the last pre-roll (the frames
+                # are not kept until it is done)
+                if self.rings:
+                    return
+                self.ring = np.empty((self.pre_roll,) + frame.shape, frame.dtype)
+                self.rings += 1
+        np.copyto(self.ring[self.head], frame)
+        self.head = (self.head + 1) % self.pre_roll
+        self.count = min(self.count + 1, self.pre_roll)
+
+    def _buffer(self, frame):
+        # a free frame buffer, new ones only up to the backlog
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            if self.allocated >= self.backlog:
+                return self.free.get() if self.block else None
+            self.allocated += 1
+            return np.empty_like(frame)
+
+    def close(self):
+        # finish the running clip and wait for the encoder
+        if self.remaining is not None:
+            self.q.put(("end", None))
+            self.remaining = None
+        self.q.put(("stop", None))
+        self.thread.join()
+
+    def stats(self):
+        return {"clips": self.clips, "dropped": self.dropped}
+
+    def _encoder(self):
+        writer = None
+        name = None
+        while True:
+            (kind, item) = self.q.get()
+            if kind == "stop":
+                break
+            if kind == "start":
+                (name, ring, head, count) = item
+                if ring is None:
+                    continue
+                # the pre-roll, oldest frame first
+                writer = cv2.VideoWriter(name, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                    ring.shape[2:0:-1], True)
+                for i in range(head - count, head):
+                    writer.write(ring[i % len(ring)])
+                self.spare.put(ring)
+            elif kind == "frame":
+                if writer is None:
+                    # a clip triggered before the first frame arrived
+                    writer = cv2.VideoWriter(name, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                        item.shape[1::-1], True)
+                writer.write(item)
+                self.free.put(item)
+            elif kind == "end" and writer is not None:
+                writer.release()
+                writer = None
+                logger.info("Saved clip {}".format(name))
+        if writer is not None:
+            writer.release()
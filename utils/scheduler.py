@@ -0,0 +1,92 @@
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+def parse_days(days):
+    # "mon-fri", "sat,sun", "daily" or a list of those, as weekday numbers
+    if isinstance(days, str):
+        days = days.split(",")
+    weekdays = set()
+    for part in days:
+        part = part.strip().lower()
+        if part in ("daily", "*"):
+            return set(range(7))
+        (first, _, last) = part.partition("-")
+        if first[:3] not in DAYS or (last and last[:3] not in DAYS):
+            raise ValueError("unknown day in schedule: {}".format(part))
+        (a, b) = (DAYS.index(first[:3]), DAYS.index((last or first)[:3]))
+        # ranges may wrap around the week, e.g. "fri-mon"
+        weekdays.update(d % 7 for d in range(a, b + 1 if b >= a else b + 8))
+    return weekdays
+
+def parse_time(text):
+    # "HH:MM" as the time since midnight, "24:00" is the end of the day
+    (hours, minutes) = (int(v) for v in text.split(":"))
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or (hours == 24 and minutes):
+        raise ValueError("invalid time in schedule: {}".format(text))
+    return datetime.timedelta(hours = hours, minutes = minutes)
+
+class Window:
+    """ A start/stop time on some weekdays, for all or some of the cameras. """
+
+    def __init__(self, days = "daily", start = "00:00", stop = "24:00", cameras = None):
+        self.days = parse_days(days)
+        self.start = parse_time(start)
+        self.stop = parse_time(stop)
+        # camera ids (indexes of the camera list), None for all of them
+        self.cameras = None if cameras is None else set(cameras)
+
+    def span(self, day):
+        # the (start, stop) datetimes of the window opening on the date
+        # day, None when it doesn't open that day; a stop before the start
+        # runs past midnight
+        if day.weekday() not in self.days:
+            return None
+        midnight = datetime.datetime.combine(day, datetime.time())
+        (start, stop) = (midnight + self.start, midnight + self.stop)
+        if stop <= start:
+            stop += datetime.timedelta(days = 1)
+        return (start, stop)
+
+class Schedule:
+    """ The operating windows of the counter, answering what runs when. """
+
+    def __init__(self, windows):
+        self.windows = windows
+
+    @classmethod
+    def from_config(cls, entries):
+        # [{"days": "mon-fri", "start": "09:00", "stop": "17:00", "cameras": [0, 1]}, ..]
+        return cls([Window(**entry) for entry in entries])
+
+    def spans(self, now):
+        # every window open around now, from yesterday (past midnight)
+        # to a week ahead
+        for offset in range(-1, 8):
+            day = now.date() + datetime.timedelta(days = offset)
+            for window in self.windows:
+                span = window.span(day)
+                if span is not None:
+                    yield (span[0], span[1], window.cameras)
+
+    def active(self, now, cameras):
+        # the ids out of cameras with a window open at now
+        on = set()
+        for (start, stop, ids) in self.spans(now):
+            if start <= now < stop:
+                on.update(cameras if ids is None else ids)
+        return [camera for camera in cameras if camera in on]
+
+    def next_change(self, now, cameras):
+        # the next time a window opens or closes and the active cameras
+        # change, None when nothing is scheduled
+        active = self.active(now, cameras)
+        times = sorted({t for (start, stop, _) in self.spans(now)
+            for t in (start, stop) if t > now})
+        for t in times:
+            if self.active(t, cameras) != active:
+                return t
+        return None
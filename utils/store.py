@@ -0,0 +1,363 @@
+from utils.metrics import NULL
+import collections
+import threading
+import datetime
+import logging
+import sqlite3
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# schema versions, applied in order on top of PRAGMA user_version
+MIGRATIONS = [
+    # 1: cumulative entries/exits read by the dashboard
+    """
+    CREATE TABLE IF NOT EXISTS statistics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        datetime TEXT NOT NULL,
+        entries INTEGER NOT NULL,
+        exits INTEGER NOT NULL
+    );
+    """,
+    # 2: camera id on the statistics rows and one row per crossing
+    """
+    ALTER TABLE statistics ADD COLUMN camera INTEGER NOT NULL DEFAULT 0;
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp REAL NOT NULL,
+        direction TEXT NOT NULL,
+        track_id INTEGER NOT NULL,
+        camera INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # 3: integer timestamps with indexes, and the crossings pre-aggregated
+    # per local minute/hour/day and camera (backfilled from the events)
+    """
+    ALTER TABLE statistics ADD COLUMN ts INTEGER;
+    UPDATE statistics SET ts = CAST(strftime('%s', datetime, 'utc') AS INTEGER);
+    CREATE INDEX IF NOT EXISTS statistics_ts ON statistics (ts);
+    CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+    CREATE TABLE IF NOT EXISTS rollup_minute (
+        bucket INTEGER NOT NULL,
+        camera INTEGER NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        exits INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, camera)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS rollup_hour (
+        bucket INTEGER NOT NULL,
+        camera INTEGER NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        exits INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, camera)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS rollup_day (
+        bucket INTEGER NOT NULL,
+        camera INTEGER NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        exits INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, camera)
+    ) WITHOUT ROWID;
+    INSERT INTO rollup_minute (bucket, camera, entries, exits)
+        SELECT CAST(strftime('%s', strftime('%Y-%m-%d %H:%M:00', timestamp, 'unixepoch', 'localtime'), 'utc') AS INTEGER),
+            camera, SUM(direction = 'in'), SUM(direction = 'out')
+        FROM events GROUP BY 1, 2;
+    INSERT INTO rollup_hour (bucket, camera, entries, exits)
+        SELECT CAST(strftime('%s', strftime('%Y-%m-%d %H:00:00', timestamp, 'unixepoch', 'localtime'), 'utc') AS INTEGER),
+            camera, SUM(direction = 'in'), SUM(direction = 'out')
+        FROM events GROUP BY 1, 2;
+    INSERT INTO rollup_day (bucket, camera, entries, exits)
+        SELECT CAST(strftime('%s', date(timestamp, 'unixepoch', 'localtime'), 'utc') AS INTEGER),
+            camera, SUM(direction = 'in'), SUM(direction = 'out')
+        FROM events GROUP BY 1, 2;
+    """,
+    # 4: the counting zone (line) an event crossed, NULL for the default line
+    """
+    ALTER TABLE events ADD COLUMN zone TEXT;
+    """,
+    # 5: the rollups of the crossings only kept in statistics (written
+    # before there were events), from the differences between consecutive
+    # cumulative rows of a camera; the counter starts again from 0 on
+    # restart, so a row below the one before it counts from 0
+    """
+    CREATE TEMP TABLE history AS
+        SELECT ts, camera,
+            CASE WHEN restart THEN entries ELSE entries - last_entries END AS entries,
+            CASE WHEN restart THEN exits ELSE exits - last_exits END AS exits
+        FROM (SELECT ts, camera, entries, exits,
+                LAG(entries, 1, 0) OVER w AS last_entries, LAG(exits, 1, 0) OVER w AS last_exits,
+                entries < LAG(entries, 1, 0) OVER w OR exits < LAG(exits, 1, 0) OVER w AS restart
+            FROM statistics WINDOW w AS (PARTITION BY camera ORDER BY id)) AS s
+        WHERE ts IS NOT NULL AND ts < COALESCE((SELECT MIN(timestamp) FROM events
+            WHERE events.camera = s.camera), 1e18);
+    INSERT INTO rollup_minute (bucket, camera, entries, exits)
+        SELECT CAST(strftime('%s', strftime('%Y-%m-%d %H:%M:00', ts, 'unixepoch', 'localtime'), 'utc') AS INTEGER),
+            camera, SUM(entries), SUM(exits)
+        FROM history WHERE true GROUP BY 1, 2
+        ON CONFLICT (bucket, camera) DO UPDATE SET entries = entries + excluded.entries, exits = exits + excluded.exits;
+    INSERT INTO rollup_hour (bucket, camera, entries, exits)
+        SELECT CAST(strftime('%s', strftime('%Y-%m-%d %H:00:00', ts, 'unixepoch', 'localtime'), 'utc') AS INTEGER),
+            camera, SUM(entries), SUM(exits)
+        FROM history WHERE true GROUP BY 1, 2
+        ON CONFLICT (bucket, camera) DO UPDATE SET entries = entries + excluded.entries, exits = exits + excluded.exits;
+    INSERT INTO rollup_day (bucket, camera, entries, exits)
+        SELECT CAST(strftime('%s', date(ts, 'unixepoch', 'localtime'), 'utc') AS INTEGER),
+            camera, SUM(entries), SUM(exits)
+        FROM history WHERE true GROUP BY 1, 2
+        ON CONFLICT (bucket, camera) DO UPDATE SET entries = entries + excluded.entries, exits = exits + excluded.exits;
+    DROP TABLE history;
+    """,
+]
+
+# bucket sizes (seconds) of the rollup tables, coarsest first
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+ROLLUPS = ((DAY, "rollup_day"), (HOUR, "rollup_hour"), (MINUTE, "rollup_minute"))
+
+def bucket_start(ts, size):
+    # start (unix seconds) of the local minute/hour/day holding ts, days
+    # follow the local calendar across DST changes
+    t = datetime.datetime.fromtimestamp(ts).replace(second = 0, microsecond = 0)
+    if size >= HOUR:
+        t = t.replace(minute = 0)
+    if size >= DAY:
+        t = t.replace(hour = 0)
+    return int(t.timestamp())
+
+def bucket_next(ts, size):
+    # start of the first bucket after ts (ts itself when it starts one)
+    start = bucket_start(ts, size)
+    if start == ts:
+        return start
+    if size >= DAY:
+        t = datetime.datetime.fromtimestamp(start) + datetime.timedelta(days = 1)
+        return int(t.timestamp())
+    return start + size
+
+def connect(path, timeout = 30):
+    # open the database in WAL mode so the dashboard can read while the
+    # counter writes, and bring the schema up to date
+    conn = sqlite3.connect(path, timeout = timeout)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    migrate(conn)
+    return conn
+
+def migrate(conn):
+    # the counter's workers and the dashboard may open the database at the
+    # same time: every step takes the write lock first and checks the
+    # version again under it, so each migration runs exactly once
+    for (i, script) in enumerate(MIGRATIONS, start = 1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= i:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < i:
+                for statement in filter(str.strip, script.split(";")):
+                    conn.execute(statement)
+                conn.execute("PRAGMA user_version = {}".format(i))
+                logger.info("Database migrated to version {}".format(i))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+class EventStore:
+    """ Queues crossing events and writes them in batches from a background thread. """
+
+    def __init__(self, path = "people_count.db", batch_size = 50, interval = 1.0, metrics = NULL):
+        self.path = path
+        # times the batch writes when enabled
+        self.metrics = metrics
+        # flush when this many events are queued or the oldest one has
+        # waited this many seconds
+        self.batch_size = batch_size
+        self.interval = interval
+        self.q = queue.Queue()
+        self.written = 0
+        # the connection is created (and used) by the writer thread only
+        self.thread = threading.Thread(target = self._writer, daemon = True)
+        self.ready = threading.Event()
+        self.error = None
+        self.thread.start()
+        self.ready.wait()
+        # the database could not be opened (bad path, corrupt file, ..)
+        if self.error is not None:
+            raise self.error
+
+    def add(self, direction, track_id, entries, exits, camera = 0, timestamp = None, zone = None):
+        # record a crossing, never blocks on the disk
+        timestamp = time.time() if timestamp is None else timestamp
+        self.q.put((timestamp, direction, track_id, entries, exits, camera, zone))
+
+    def close(self):
+        # flush whatever is left and stop the writer
+        self.q.put(None)
+        self.thread.join()
+
+    def _writer(self):
+        try:
+            conn = connect(self.path)
+        except sqlite3.Error as e:
+            # raised again by the constructor, which waits on ready
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        batch = []
+        deadline = None
+        running = True
+        while running:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            try:
+                item = self.q.get(timeout = timeout)
+                if item is None:
+                    running = False
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.time() + self.interval
+            except queue.Empty:
+                pass
+
+            if batch and (not running or len(batch) >= self.batch_size or time.time() >= deadline):
+                start = self.metrics.time()
+                try:
+                    self._flush(conn, batch)
+                except sqlite3.Error as e:
+                    logger.error("Failed to write {} events: {}".format(len(batch), e))
+                self.metrics.observe("db_write", start)
+                batch = []
+                deadline = None
+        conn.close()
+
+    def _flush(self, conn, batch):
+        # write the whole batch in a single transaction
+        with conn:
+            conn.executemany("INSERT INTO events (timestamp, direction, track_id, camera, zone) VALUES (?, ?, ?, ?, ?)",
+                [(t, d, i, c, z) for (t, d, i, _, _, c, z) in batch])
+            conn.executemany("INSERT INTO statistics (datetime, ts, entries, exits, camera) VALUES (?, ?, ?, ?, ?)",
+                [(datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M"), int(t), n_in, n_out, c)
+                    for (t, _, _, n_in, n_out, c, _) in batch])
+
+            # add the batch to the rollups, summed per bucket first so a
+            # busy minute is a single upsert
+            for (size, table) in ROLLUPS:
+                counts = {}
+                for (t, d, _, _, _, c, _) in batch:
+                    key = (bucket_start(t, size), c)
+                    (n_in, n_out) = counts.get(key, (0, 0))
+                    counts[key] = (n_in + (d == "in"), n_out + (d == "out"))
+                conn.executemany("INSERT INTO {} (bucket, camera, entries, exits) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (bucket, camera) DO UPDATE SET entries = entries + excluded.entries, "
+                    "exits = exits + excluded.exits".format(table),
+                    [(b, c, n_in, n_out) for ((b, c), (n_in, n_out)) in counts.items()])
+        self.written += len(batch)
+
+class StatsReader:
+    """ One read connection shared by the dashboard windows, fetching only new rows. """
+
+    def __init__(self, path = "people_count.db", history = 1000):
+        self.conn = connect(path)
+        # the newest statistics rows (id, datetime, entries, exits, camera),
+        # oldest first; entries/exits are the running totals of their camera
+        self.rows = collections.deque(maxlen = history)
+        self.version = None
+        self.last_id = 0
+
+    def refresh(self):
+        # True when rows were added since the last call; PRAGMA data_version
+        # only changes when another connection commits, so an idle database
+        # costs a single pragma per poll
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return False
+        self.version = version
+        if not self.rows:
+            # start with the last `history` rows, not the whole table
+            rows = self.conn.execute("SELECT * FROM (SELECT id, datetime, entries, exits, camera "
+                "FROM statistics ORDER BY id DESC LIMIT ?) ORDER BY id", (self.rows.maxlen,)).fetchall()
+        else:
+            rows = self.conn.execute("SELECT id, datetime, entries, exits, camera FROM statistics "
+                "WHERE id > ? ORDER BY id", (self.last_id,)).fetchall()
+        if not rows:
+            return False
+        self.rows.extend(rows)
+        self.last_id = rows[-1][0]
+        return True
+
+    def since(self, last_id):
+        # the rows newer than last_id, oldest first
+        rows = []
+        for row in reversed(self.rows):
+            if row[0] <= last_id:
+                break
+            rows.append(row)
+        rows.reverse()
+        return rows
+
+    def buckets(self, start, end, size = HOUR, camera = None):
+        # [(bucket start, entries, exits)] of the buckets of size seconds
+        # (a multiple of a minute) between start and end (unix seconds),
+        # read from the coarsest rollup table that fits; buckets without
+        # crossings are left out
+        if size < MINUTE or size % MINUTE:
+            raise ValueError("bucket size must be a multiple of {} seconds".format(MINUTE))
+        (step, table) = next((s, t) for (s, t) in ROLLUPS if size % s == 0)
+        where = "bucket >= ? AND bucket < ?"
+        params = [bucket_start(start, step), end]
+        if camera is not None:
+            where += " AND camera = ?"
+            params.append(camera)
+        rows = self.conn.execute("SELECT bucket, SUM(entries), SUM(exits) FROM {} WHERE {} "
+            "GROUP BY bucket ORDER BY bucket".format(table, where), params).fetchall()
+        if size == step:
+            return rows
+
+        # larger buckets (e.g. 15 minutes, a week) are counted from start,
+        # whole days by the local calendar like the day table (a day
+        # changing to/from DST isn't 86400 seconds)
+        first = params[0]
+        origin = datetime.date.fromtimestamp(first)
+        merged = {}
+        for (bucket, n_in, n_out) in rows:
+            if step == DAY:
+                days = (datetime.date.fromtimestamp(bucket) - origin).days // (size // DAY) * (size // DAY)
+                key = int(datetime.datetime.combine(origin + datetime.timedelta(days = days),
+                    datetime.time()).timestamp())
+            else:
+                key = first + (bucket - first) // size * size
+            (m_in, m_out) = merged.get(key, (0, 0))
+            merged[key] = (m_in + n_in, m_out + n_out)
+        return [(key, n_in, n_out) for (key, (n_in, n_out)) in sorted(merged.items())]
+
+    def totals(self, start, end, camera = None):
+        # (entries, exits) between start and end to the minute: the whole
+        # days from the day table, the hours and minutes around them from
+        # the finer ones, so months cost a handful of rows
+        (entries, exits) = (0, 0)
+        ranges = [(bucket_start(start, MINUTE), bucket_start(end, MINUTE))]
+        for (size, table) in ROLLUPS:
+            rest = []
+            for (a, b) in ranges:
+                (first, last) = (bucket_next(a, size), bucket_start(b, size))
+                if first >= last:
+                    rest.append((a, b))
+                    continue
+                where = "bucket >= ? AND bucket < ?"
+                params = [first, last]
+                if camera is not None:
+                    where += " AND camera = ?"
+                    params.append(camera)
+                (n_in, n_out) = self.conn.execute("SELECT TOTAL(entries), TOTAL(exits) FROM {} "
+                    "WHERE {}".format(table, where), params).fetchone()
+                entries += int(n_in)
+                exits += int(n_out)
+                rest += [(a, first), (last, b)]
+            ranges = [(a, b) for (a, b) in rest if a < b]
+        return (entries, exits)
+
+    def close(self):
+        self.conn.close()
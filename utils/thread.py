@@ -1,31 +1,95 @@
-import cv2, threading, queue
+import cv2, threading, logging, time
+
+logger = logging.getLogger(__name__)
 
 class ThreadingClass:
   # initiate threading class
-  def __init__(self, name):
+  def __init__(self, name, slots=3, reconnect=True, backoff=1.0, max_backoff=30.0):
+    self.name = name
     self.cap = cv2.VideoCapture(name)
-	  # define an empty queue and thread
-    self.q = queue.Queue()
-    t = threading.Thread(target=self._reader)
-    t.daemon = True
-    t.start()
+    # a fixed ring of frame buffers the reader decodes into (in place
+    # of a queue), the newest unread slot and the slot the caller holds
+    self.slots = [None] * max(3, slots)
+    self.stamps = [None] * len(self.slots)
+    self.latest = None
+    self.held = None
+    self.cond = threading.Condition()
+
+    # reopen the camera when it stops delivering frames (RTSP/IP cameras
+    # drop out), waiting backoff seconds, doubled up to max_backoff
+    self.reconnect = reconnect
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+
+    # sequence number and capture time of the frame last returned by
+    # read(), frames read from the camera, frames replaced before anybody
+    # read them and reconnects
+    self.sequence = None
+    self.timestamp = None
+    self.frames = 0
+    self.dropped = 0
+    self.reconnects = 0
+    self.ended = False
+    self.stopping = threading.Event()
+
+    self.thread = threading.Thread(target=self._reader)
+    self.thread.daemon = True
+    self.thread.start()
 
   # read the frames as soon as they are available
   # this approach removes OpenCV's internal buffer and reduces the frame lag
   def _reader(self):
-    while True:
-      ret, frame = self.cap.read() # read the frames and ---
+    delay = self.backoff
+    while not self.stopping.is_set():
+      # decode into a slot that is neither held by the caller nor the
+      # newest frame (there always is one with 3 slots)
+      with self.cond:
+        i = next(j for j in range(len(self.slots)) if j != self.held and j != self.latest)
+      ret, frame = self.cap.read(self.slots[i]) # read the frames and ---
       if not ret:
-        break
-      if not self.q.empty():
-        try:
-          self.q.get_nowait()
-        except queue.Empty:
-          pass
-      self.q.put(frame) # --- store them in a queue (instead of the buffer)
+        if not self.reconnect:
+          break
+        logger.warning("No frame from {}, reconnecting in {:.1f}s".format(self.name, delay))
+        self.cap.release()
+        if self.stopping.wait(delay):
+          break
+        self.cap = cv2.VideoCapture(self.name)
+        self.reconnects += 1
+        delay = min(delay * 2, self.max_backoff)
+        continue
+      delay = self.backoff
+
+      with self.cond:
+        # the newest frame was never read, the caller only gets the latest
+        if self.latest is not None:
+          self.dropped += 1
+        self.slots[i] = frame # --- store them in the ring (instead of the buffer)
+        self.stamps[i] = (self.frames, time.time())
+        self.frames += 1
+        self.latest = i
+        self.cond.notify_all()
+
+    # wake up a waiting read() for good
+    with self.cond:
+      self.ended = True
+      self.cond.notify_all()
+
+  # fetch the newest frame, it stays valid until the next read(); returns
+  # None after timeout seconds without a new frame or once the reader ended
+  def read(self, timeout=None):
+    with self.cond:
+      self.cond.wait_for(lambda: self.latest is not None or self.ended, timeout)
+      if self.latest is None:
+        return None
+      self.held, self.latest = self.latest, None
+      (self.sequence, self.timestamp) = self.stamps[self.held]
+      return self.slots[self.held]
 
-  def read(self):
-    return self.q.get() # fetch frames from the queue one by one
+  def stats(self):
+    return {"frames": self.frames, "dropped": self.dropped, "reconnects": self.reconnects}
 
   def release(self):
+    # stop the reader before releasing the camera under it
+    self.stopping.set()
+    self.thread.join(timeout=5.0)
     return self.cap.release() # release the hw resource